@@ -1,13 +1,19 @@
 import dash
 from dash import dcc, html
 from dash.dependencies import Input, Output
+import numpy as np
 import pandas as pd
 import plotly.express as px
 import datetime
 import plotly.graph_objects as go
 
 # Load the data
-simulation_data = pd.read_csv('data/elect_college_predictions.csv')
+ev_histogram = np.load('data/elect_college_histogram.npz')
+simulation_data = pd.DataFrame({
+    'points': np.arange(ev_histogram['hist'].size),
+    'count': ev_histogram['hist']
+}).query('count > 0')
+simulation_data['winner'] = np.where(simulation_data['points'] >= 270, 'Trump', 'Harris')
 tracking_data = pd.read_csv('data/predictions.csv')
 state_probabilities = pd.read_csv('data/state_predictions.csv')
 
@@ -30,8 +36,11 @@ election_date = datetime.datetime(2024, 11, 5)
 days_until_election = (election_date - datetime.datetime.now()).days
 
 # Calculate the projected winner dynamically
-def calculate_projected_winner(simulation_data):
-    winner_counts = simulation_data['winner'].value_counts()
+def calculate_projected_winner(ev_histogram):
+    winner_counts = pd.Series({
+        'Trump': ev_histogram['trump_wins'],
+        'Harris': ev_histogram['harris_wins']
+    })
     projected_winner = winner_counts.idxmax()  # Get the candidate with the most wins
     return projected_winner
 
@@ -211,15 +220,18 @@ def update_dashboard(_):
     fig_distribution = px.histogram(
         simulation_data,
         x='points',
+        y='count',
+        histfunc='sum',
         color='winner',
         nbins=50,
         title="Today's Simulations Won by Candidate",
         labels={"points": "EC Votes (Trump Wins)"},
         template="plotly_white"
     )
+    fig_distribution.update_layout(yaxis_title="count")
 
     # Calculate projected winner
-    projected_winner = calculate_projected_winner(simulation_data)
+    projected_winner = calculate_projected_winner(ev_histogram)
 
     return fig_map, fig_time_series, fig_distribution, projected_winner
 
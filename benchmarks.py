@@ -0,0 +1,143 @@
+'''
+rough wall-clock timings of the simulation engines, run with `python benchmarks.py`
+'''
+import os
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from election_helpers import EC_DATA, numba, simulate_election_streaming, \
+    _clean_head_to_head, read_polls
+
+def time_call(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+def bench_simulation_backends(simulation_nums=(1000000, 100000000)):
+    rng = np.random.default_rng(0)
+    preds = {
+        state:round(float(rng.uniform(1, 99)), 1)
+        for state in EC_DATA if state != 'National'
+    }
+
+    backends = ['numpy']
+    if numba is not None:
+        backends.append('numba')
+        # compile outside of the timings
+        simulate_election_streaming(preds, 10, seed=0, backend='numba')
+    else:
+        print("numba not installed, only timing the numpy backend")
+
+    for simulation_num in simulation_nums:
+        for backend in backends:
+            elapsed, (trump_won, hist) = time_call(
+                simulate_election_streaming, preds, simulation_num, seed=0, backend=backend
+            )
+            print(f"simulate_election_streaming {simulation_num:>11,} sims  {backend:<5} "
+                  f"{elapsed:8.2f}s  win={trump_won:.4f}")
+
+def synthetic_polls(n_questions=20000, seed=0):
+    '''
+    poll rows shaped like the 538 president_polls.csv: 2-4 answers per
+    question, mostly Harris (16661) v Trump (16651)
+    '''
+    rng = np.random.default_rng(seed)
+    n_answers = rng.choice([2, 3, 4], size=n_questions, p=[0.6, 0.3, 0.1])
+    question_id = np.repeat(rng.permutation(n_questions) + 100000, n_answers)
+    position = np.concatenate([np.arange(n) for n in n_answers])
+    others = rng.choice([16661, 16651, 16654, 16662], size=question_id.size)
+    candidate_id = np.where(position == 0, 16651, np.where(position == 1, 16661, others))
+    # some questions without Harris
+    candidate_id = np.where((position == 1) & (question_id % 7 == 0), 16654, candidate_id)
+    pct = rng.uniform(30, 55, size=question_id.size)
+    pct[rng.random(pct.size) < 0.01] = np.nan
+
+    return pd.DataFrame({
+        'question_id':question_id,
+        'candidate_id':candidate_id,
+        'pct':pct,
+        'state':np.repeat(rng.choice(list(EC_DATA), size=n_questions), n_answers),
+        'sample_size':np.repeat(rng.integers(300, 3000, size=n_questions), n_answers)
+    })
+
+def _legacy_head_to_head(data):
+    # the groupby.apply implementation load_polling_data used before
+    def identify_multi_candidate(data):
+        if data.shape[0] > 2:
+            data['MultiCandidate'] = 1
+        elif data.shape[0] == 2:
+            data['MultiCandidate'] = 0
+        else:
+            raise Exception("Something weird going on")
+        candidate_ids = [16661,16651]
+        keep = set(data['candidate_id'].to_list()) \
+            .intersection(set(candidate_ids))
+        data['candidate_vs'] = int(len(keep)>1)
+        return data
+
+    def rescale_to_100(data):
+        data.pct = np.divide(data.pct,data.pct.sum())
+        return data
+
+    return (
+        data
+            .groupby("question_id")
+            .apply(identify_multi_candidate)
+            .reset_index(drop=True)
+            .query('candidate_vs == 1')
+            .drop(columns = ['candidate_vs'])
+            .reset_index(drop=True)
+            .query('candidate_id == 16661 or candidate_id == 16651')
+            .groupby("question_id")
+            .apply(rescale_to_100)
+            .reset_index(drop=True)
+            .query("candidate_id == 16651")
+    )
+
+def bench_poll_cleaning(n_questions=20000):
+    data = synthetic_polls(n_questions)
+
+    legacy_time, legacy = time_call(_legacy_head_to_head, data.copy())
+    vectorized_time, vectorized = time_call(_clean_head_to_head, data.copy())
+
+    pd.testing.assert_frame_equal(legacy, vectorized[legacy.columns])
+    print(f"poll cleaning {n_questions:,} questions  groupby.apply {legacy_time:6.2f}s  "
+          f"vectorized {vectorized_time:6.2f}s  ({legacy_time/vectorized_time:.0f}x)")
+
+def bench_poll_reading(n_questions=50000):
+    data = synthetic_polls(n_questions)
+    rng = np.random.default_rng(0)
+    data = data.assign(
+        methodology = rng.choice(['Online Panel', 'Live Phone', 'IVR'], size=len(data)),
+        population = rng.choice(['lv', 'rv', 'a'], size=len(data)),
+        partisan = rng.choice(['REP', 'DEM', ''], size=len(data)),
+        end_date = '10/1/24',
+        numeric_grade = rng.choice([1.5, 2.0, 3.0], size=len(data))
+    )
+    # pad to the width of the real file with unused text columns
+    for i in range(40):
+        data[f'unused_{i}'] = 'some pollster text'
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'president_polls.csv')
+        data.to_csv(path, index=False)
+
+        full_time, full = time_call(pd.read_csv, path)
+        pruned_time, pruned = time_call(read_polls, path)
+        print(f"poll reading {len(data):,} rows  full read {full_time:6.2f}s "
+              f"{full.memory_usage(deep=True).sum()/1e6:7.1f}MB  "
+              f"pruned {pruned_time:6.2f}s {pruned.memory_usage(deep=True).sum()/1e6:7.1f}MB")
+
+        try:
+            arrow_time, _ = time_call(read_polls, path, engine='pyarrow')
+            print(f"poll reading {len(data):,} rows  pruned with pyarrow engine {arrow_time:6.2f}s")
+        except ImportError:
+            print("pyarrow not installed, skipping the pyarrow engine")
+
+if __name__ == '__main__':
+    bench_simulation_backends()
+    bench_poll_cleaning()
+    bench_poll_reading()
@@ -1,18 +1,34 @@
 from election_helpers import load_polling_data, \
     simulate_election_states, fit_bhm, \
-    simulate_election, get_credible_interval, \
+    simulate_election_adaptive, get_win_rate_interval, \
     fit_bhm_custom_belief, update_priors, \
-    fit_bayes_beta, update_custom_priors
+    fit_bayes_beta, update_custom_priors, \
+    save_ev_histogram, SOURCES, \
+    save_design_matrix, load_design_matrix
+from http_cache import fetch_sources
+from reference_data import state_abbreviations
 import pandas as pd
-import numpy as np
 from datetime import datetime
 import matplotlib.pyplot as plt
 
 reset_priors = False
 reset_tracker = False
+rebuild_features = False # set when 538 revises past polls
+
+# Download all remote inputs concurrently
+paths = fetch_sources(SOURCES)
+
+# Fetch Data, only cleaning questions not seen in earlier runs
+y_vec, x_matrix, state_dict = load_polling_data(
+    paths['polls'], feature_store='./data/poll_features.csv', rebuild=rebuild_features
+)
+
+# Persist the design matrix and fit from the memory-mapped arrays,
+# backtests can load the same store without recleaning the polls
+save_design_matrix(y_vec, x_matrix, state_dict)
+y_vec, X, states, covariates, state_dict = load_design_matrix()
+x_matrix = (X, states)
 
-# Fetch Data
-y_vec, x_matrix, state_dict = load_polling_data()
 priors = pd.read_csv('./data/priors.csv')
 priors.sd = priors.sd * 50 # added this because priors were too strong
 
@@ -27,22 +43,20 @@ if not reset_priors:
 # Predict State Level Probabilities
 preds = simulate_election_states(model, state_dict, x_matrix, trace)
 
-# Run Presidential Simulations
-win_perc, sim_data = simulate_election(preds, 50000)
+# Run Presidential Simulations until the win percentage is precise enough
+win_perc, ev_hist, std_error = simulate_election_adaptive(preds, tolerance=0.002)
 
 # A Few Post-Processing Steps
-sim_data = sim_data.assign(winner = lambda x:np.where(x.winner == 0, "Harris", "Trump"))
-to_join = pd.read_csv('https://raw.githubusercontent.com/jasonong/List-of-US-States/master/states.csv')
+abbreviations = state_abbreviations()
 prob_data = pd.DataFrame({
     'State':list(preds.keys()),
     'Trump Win Prob.':list(preds.values())
 }) \
-    .merge(to_join, on='State') \
-    .assign(State = lambda x:x.Abbreviation) \
-    .drop(columns = ['Abbreviation'])
+    .assign(State = lambda x:x.State.map(abbreviations)) \
+    .dropna(subset = ['State'])
 
 # Calculate Simulation Confidence Interval
-LB, UB = get_credible_interval(sim_data)
+LB, UB = get_win_rate_interval(ev_hist[270:].sum(), ev_hist.sum())
 
 # Add new row to tracker
 if reset_tracker:
@@ -76,5 +90,5 @@ tracking_data = tracking_data.assign(Date = pd.to_datetime(tracking_data['Date']
 
 # Saving Data
 prob_data.to_csv("./data/state_predictions.csv", index = False)
-sim_data.to_csv("./data/elect_college_predictions.csv", index = False)
+save_ev_histogram(ev_hist)
 tracking_data.to_csv("./data/predictions.csv", index = False)
@@ -1,14 +1,234 @@
+import json
+import multiprocessing
+import os
+import warnings
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
 import pandas as pd
 import numpy as np
 import pymc as pm
 import arviz as az
+from scipy import stats
+from scipy.optimize import brentq
+from scipy.special import expit, logit
+from scipy.stats import qmc
 from pytensor.printing import Print
 
-def load_polling_data():
+from http_cache import cached_download
+from reference_data import fallback_states_2020
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+# electoral votes by state, including the Maine and Nebraska CD splits
+EC_DATA = {'Arizona': 11,
+    'Georgia': 16,
+    'Pennsylvania': 19,
+    'Michigan': 15,
+    'Nevada': 6,
+    'Wisconsin': 10,
+    'North Carolina': 3,
+    'Ohio': 17,
+    'Florida': 30,
+    'New Hampshire': 4,
+    'New York': 28,
+    'California': 54,
+    'Iowa': 6,
+    'Tennessee': 11,
+    'Virginia': 13,
+    'Missouri': 10,
+    'Texas': 40,
+    'Colorado': 10,
+    'Montana': 4,
+    'Washington': 12,
+    'Illinois': 19,
+    'Connecticut': 7,
+    'Oklahoma': 7,
+    'New Mexico': 5,
+    'Kansas': 6,
+    'Massachusetts': 11,
+    'Minnesota': 10,
+    'Kentucky': 8,
+    'Alaska': 3,
+    'Oregon': 8,
+    'Nebraska': 2,
+    'South Carolina': 9,
+    'Maryland': 10,
+    'Rhode Island': 4,
+    'Arkansas': 6,
+    'South Dakota': 3,
+    'Louisiana': 8,
+    'Mississippi': 6,
+    'Maine': 2,
+    'Utah': 6,
+    'Idaho': 4,
+    'Alabama': 9,
+    'West Virginia': 4,
+    'Indiana': 11,
+    'North Dakota': 3,
+    'Wyoming': 3,
+    'Vermont': 3,
+    'New Jersey': 14,
+    'National': 1,
+    'NE-1': 1,
+    'NE-2': 1,
+    'NE-3':1,
+    'ME-2': 1,
+    'ME-1': 1,
+    'Hawaii': 4,
+    'District of Columbia': 3,
+    'Delaware': 3}
+
+# the same table as arrays with a stable integer index, so hot paths can
+# look electoral votes up by position instead of by state name
+EC_STATES = np.array(list(EC_DATA.keys()))
+EC_VOTES = np.array(list(EC_DATA.values()))
+EC_INDEX = {state:i for i,state in enumerate(EC_STATES)}
+
+# census regions used for the regional swing in correlated simulations,
+# CD splits follow their state
+REGIONS = {
+    'Northeast': [
+        'Connecticut', 'Maine', 'ME-1', 'ME-2', 'Massachusetts', 'New Hampshire',
+        'New Jersey', 'New York', 'Pennsylvania', 'Rhode Island', 'Vermont'
+    ],
+    'Midwest': [
+        'Illinois', 'Indiana', 'Iowa', 'Kansas', 'Michigan', 'Minnesota', 'Missouri',
+        'Nebraska', 'NE-1', 'NE-2', 'NE-3', 'North Dakota', 'Ohio', 'South Dakota',
+        'Wisconsin'
+    ],
+    'South': [
+        'Alabama', 'Arkansas', 'Delaware', 'District of Columbia', 'Florida', 'Georgia',
+        'Kentucky', 'Louisiana', 'Maryland', 'Mississippi', 'North Carolina', 'Oklahoma',
+        'South Carolina', 'Tennessee', 'Texas', 'Virginia', 'West Virginia'
+    ],
+    'West': [
+        'Alaska', 'Arizona', 'California', 'Colorado', 'Hawaii', 'Idaho', 'Montana',
+        'Nevada', 'New Mexico', 'Oregon', 'Utah', 'Washington', 'Wyoming'
+    ]
+}
+STATE_REGIONS = {state:region for region,states in REGIONS.items() for state in states}
+
+STATE_INDEX_PATH = './data/state_index.csv'
+
+def load_state_index(path=STATE_INDEX_PATH, states=()):
+    '''
+    canonical state -> integer id shared by the design matrix, the priors,
+    the EV table and the outputs
+
+    seeded from the EC_DATA order and persisted, states not seen before
+    (e.g. a newly polled CD) are appended so existing ids never change
+    '''
+    if os.path.exists(path):
+        index = pd.read_csv(path)
+        state_index = dict(zip(index.state, index.id))
+    else:
+        state_index = {str(state):i for state,i in EC_INDEX.items()}
+
+    new_states = sorted(set(states) - set(state_index))
+    for state in new_states:
+        state_index[state] = len(state_index)
+
+    if new_states or not os.path.exists(path):
+        pd.DataFrame({'state':list(state_index), 'id':list(state_index.values())}) \
+            .to_csv(path, index=False)
+
+    return state_index
+
+def n_states(states_dict):
+    '''
+    length of a per-state parameter indexed by canonical id, unpolled
+    states in between keep their slot
+    '''
+    return max(states_dict.values()) + 1
+
+def ev_vector(states_dict):
+    '''
+    electoral votes as an array aligned with the integer state ids of
+    states_dict (as returned by load_polling_data), so ev[state_id] is the
+    state's electoral votes; the national polls carry no electoral votes
+    '''
+    ev = np.zeros(max(states_dict.values()) + 1, dtype=EC_VOTES.dtype)
+    for state, i in states_dict.items():
+        if state != 'National':
+            ev[i] = EC_VOTES[EC_INDEX[state]]
+    return ev
+
+# the president_polls.csv columns load_polling_data uses, with explicit
+# dtypes so the rest of the ~50 columns are never parsed
+POLL_COLUMNS = {
+    'question_id': 'int64',
+    'candidate_id': 'int64',
+    'pct': 'float64',
+    'state': 'category',
+    'methodology': 'category',
+    'population': 'category',
+    'partisan': 'category',
+    'sample_size': 'float64',
+    'end_date': 'object',
+    'numeric_grade': 'float64'
+}
+
+def read_polls(link_538, engine=None):
+    '''
+    reads only the needed columns of president_polls.csv with explicit
+    dtypes; engine='pyarrow' uses the multithreaded pyarrow parser
+    '''
+    return pd.read_csv(
+        link_538,
+        usecols=list(POLL_COLUMNS),
+        dtype=POLL_COLUMNS,
+        engine=engine
+    )
+
+POLLS_URL = 'https://projects.fivethirtyeight.com/polls/data/president_polls.csv'
 
-    link_538 = 'https://projects.fivethirtyeight.com/polls/data/president_polls.csv'
+# remote inputs of the pipeline, name -> (url, cache ttl in seconds); the
+# 2020 averages and the states list are bundled (see reference_data) and
+# only fetched by refresh_reference_data
+SOURCES = {
+    'polls': (POLLS_URL, 0)
+}
 
-    data = pd.read_csv(link_538)
+def load_polling_data(link_538=POLLS_URL,
+                      engine=None, offline=False, feature_store=None, rebuild=False):
+    '''
+    y vector, design matrix and state ids from the 538 polls
+
+    with feature_store (a csv path) only questions not seen in earlier runs
+    are cleaned and appended to the persisted cleaned polls; rebuild=True
+    recleans everything, e.g. when 538 revises past polls
+    '''
+    # revalidated against the cached copy on every run
+    data = read_polls(cached_download(link_538, ttl=0, offline=offline), engine)
+
+    if feature_store is None:
+        data = clean_polls(data)
+    else:
+        data = update_feature_store(data, feature_store, rebuild)
+
+    return build_design_matrix(data)
+
+def clean_polls(data):
+    '''
+    row level cleaning of the raw polls: one row per Harris v Trump
+    question with its poll features, keyed by question_id
+    '''
+    #filter out where state is NA
+    data = data.loc[~data.state.isna(),:].reset_index(drop=True)
+
+    # keep the Harris v Trump rows before any other processing
+    data = _clean_head_to_head(data) \
+        .astype({'state':'object', 'methodology':'object', 'population':'object'})
 
     # Collapsing `methodology` variable
     panels_to_keep = [
@@ -28,31 +248,16 @@ def load_polling_data():
     # Adding a partisan variable
     data['rep_poll'] = np.where(data['partisan'] == 'REP', 1, 0)
 
-    #filter out where state is NA
-    data = data.loc[~data.state.isna(),:].reset_index(drop=True)
-
-    def identify_multi_candidate(data):
-        #identify multi response questions
-        if data.shape[0] > 2:
-            data['MultiCandidate'] = 1
-        elif data.shape[0] == 2:
-            data['MultiCandidate'] = 0
-        else:
-            print(data)
-            raise Exception("Something weird going on")
-        #identify non biden v trump questions
-        candidate_ids = [16661,16651]
-        keep = set(data['candidate_id'].to_list()) \
-            .intersection(set(candidate_ids))
-        keep = int(len(keep)>1)
-        data['candidate_vs'] = keep
-        return data
-
-    def rescale_to_100(data):
-        data.pct = np.divide(data.pct,data.pct.sum())
-        return data
+    data.state = data.state.replace({
+        'Nebraska CD-1':'NE-1',
+        'Nebraska CD-2':'NE-2',
+        'Nebraska CD-3':'NE-3',
+        'Maine CD-1':'ME-1',
+        'Maine CD-2':'ME-2',
+    })
 
     cols_to_keep = [
+        'question_id',
         'methodology',
         'rep_poll',
         'population',
@@ -64,21 +269,45 @@ def load_polling_data():
         'pct'
     ]
 
-    data = (
-        data
-            .groupby("question_id")
-            .apply(identify_multi_candidate)
-            .reset_index(drop=True)
-            .query('candidate_vs == 1')
-            .drop(columns = ['candidate_vs'])
-            .reset_index(drop=True)
-            .query('candidate_id == 16661 or candidate_id == 16651')
-            .groupby("question_id")
-            .apply(rescale_to_100)
+    return data[cols_to_keep].reset_index(drop=True)
+
+def update_feature_store(data, feature_store, rebuild=False):
+    '''
+    cleans only the question_ids of data not seen before, appends them to
+    the cleaned polls persisted at feature_store and returns all of them
+
+    the question_ids already processed (including the ones cleaning drops)
+    are kept next to the store so they are not parsed again
+    '''
+    seen_path = os.path.splitext(feature_store)[0] + '_question_ids.csv'
+
+    if rebuild or not os.path.exists(feature_store) or not os.path.exists(seen_path):
+        features = clean_polls(data)
+        seen = data.question_id.unique()
+    else:
+        # round_trip so the stored pct values come back bit for bit
+        features = pd.read_csv(feature_store, float_precision='round_trip')
+        seen = pd.read_csv(seen_path).question_id.values
+        new_data = data.loc[~data.question_id.isin(seen)]
+        features = pd.concat([features, clean_polls(new_data)], ignore_index=True) \
+            .sort_values('question_id', kind='stable') \
             .reset_index(drop=True)
-            .query("candidate_id == 16651")
-            [cols_to_keep]
-    )
+        seen = np.union1d(seen, new_data.question_id.unique())
+
+    features.to_csv(feature_store, index=False)
+    pd.DataFrame({'question_id':seen}).to_csv(seen_path, index=False)
+
+    return features
+
+def build_design_matrix(data, state_index=STATE_INDEX_PATH):
+    '''
+    turns the cleaned polls into the y vector, the design matrix and the
+    state ids (steps that depend on all polls at once)
+
+    states_dict holds the polled states with their canonical ids from
+    the persisted state index, in id order
+    '''
+    data = data.drop(columns = ['question_id'])
 
     # There are missing grades, so need to impute
     data.numeric_grade = data.numeric_grade.fillna(data.numeric_grade.median())
@@ -103,17 +332,9 @@ def load_polling_data():
             )
     )
     
-    data.state = data.state.replace({
-        'Nebraska CD-1':'NE-1',
-        'Nebraska CD-2':'NE-2',
-        'Nebraska CD-3':'NE-3',
-        'Maine CD-1':'ME-1',
-        'Maine CD-2':'ME-2',
-    })
-    
-    states = data.state.value_counts().index.to_list()
-    states_dict = {x:i for i,x in enumerate(states)}
-    data.state = data.state.replace(states_dict)
+    index = load_state_index(state_index, data.state.unique())
+    states_dict = {x:index[x] for x in sorted(data.state.unique(), key=index.get)}
+    data.state = data.state.map(states_dict)
     
     method = pd.get_dummies(data.methodology) \
         .drop(columns = ['Probability Panel']) \
@@ -139,22 +360,185 @@ def load_polling_data():
         data, \
         states_dict
 
+# covariates of the fit functions, the columns of the design matrix X and
+# the elements of the coefficient vector beta, in order
+COVARIATES = {
+    'Live Phone': 'methodology is live phone (baseline: probability panel)',
+    'Online Panel': 'methodology is online panel (baseline: probability panel)',
+    'Other': 'methodology is another mode (baseline: probability panel)',
+    'month': 'months since the first poll',
+    'rep_poll': 'poll sponsored by a Republican partisan',
+    'sample_size': 'poll sample size',
+    'MultiCandidate': 'question lists more than two candidates',
+    'lv': 'likely voter population (baseline: adults)',
+    'rv': 'registered voter population (baseline: adults)',
+    'grade': '538 numeric grade of 2 or more'
+}
+
+def save_design_matrix(y_vec, x_matrix, states_dict, path='./data/design_matrix.arrow'):
+    '''
+    persists the design matrix as an Arrow IPC file: y, the state ids and the
+    covariates as one row-major fixed size list column, with the covariate
+    descriptions and states_dict in the schema metadata
+    '''
+    if pa is None:
+        raise ImportError("pyarrow is needed for the design matrix store")
+
+    X = np.ascontiguousarray(x_matrix[list(COVARIATES)].to_numpy(dtype=np.float64))
+    table = pa.table({
+        'y': pa.array(np.asarray(y_vec, dtype=np.float64)),
+        'state': pa.array(x_matrix.state.to_numpy(dtype=np.int32)),
+        'X': pa.FixedSizeListArray.from_arrays(pa.array(X.ravel()), X.shape[1])
+    }).replace_schema_metadata({
+        'covariates': json.dumps([
+            {'name':name, 'description':description, 'dtype':'float64'}
+            for name,description in COVARIATES.items()
+        ]),
+        'states': json.dumps(states_dict)
+    })
+
+    with pa.OSFile(path, 'wb') as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+
+def load_design_matrix(path='./data/design_matrix.arrow', memory_map=True):
+    '''
+    loads a design matrix saved by save_design_matrix; with memory_map the
+    arrays are zero-copy views of the mapped file
+
+    returns y, the (polls x covariates) float array, the state id vector,
+    the covariate names and states_dict
+    '''
+    if pa is None:
+        raise ImportError("pyarrow is needed for the design matrix store")
+
+    source = pa.memory_map(path) if memory_map else pa.OSFile(path)
+    table = pa.ipc.open_file(source).read_all()
+    metadata = table.schema.metadata
+
+    covariates = [x['name'] for x in json.loads(metadata[b'covariates'])]
+    states_dict = json.loads(metadata[b'states'])
+
+    y_vec = table.column('y').combine_chunks().to_numpy()
+    states = table.column('state').combine_chunks().to_numpy()
+    X = table.column('X').combine_chunks().flatten().to_numpy() \
+        .reshape(-1, len(covariates))
+
+    return y_vec, X, states, covariates, states_dict
+
+def _clean_head_to_head(data):
+    '''
+    flags multi candidate questions, keeps the Harris v Trump answers of
+    questions that include both, rescales them to sum to 1 and returns
+    the Trump rows ordered by question_id
+    '''
+    #identify multi response questions
+    n_answers = data.groupby("question_id")['question_id'].transform('size')
+    if (n_answers < 2).any():
+        print(data.loc[n_answers < 2])
+        raise Exception("Something weird going on")
+    data = data.assign(MultiCandidate = np.where(n_answers > 2, 1, 0))
+
+    #identify non harris v trump questions
+    candidate_ids = [16661,16651]
+    head_to_head = data.candidate_id.isin(candidate_ids)
+    n_matched = data.candidate_id.where(head_to_head) \
+        .groupby(data.question_id) \
+        .transform('nunique')
+    data = data.loc[head_to_head & (n_matched > 1)]
+
+    data = data.assign(pct = data.pct/data.groupby("question_id").pct.transform('sum'))
+
+    return (
+        data
+            .sort_values("question_id", kind='stable')
+            .reset_index(drop=True)
+            .query("candidate_id == 16651")
+    )
+
 def load_priors(var, metric, priors):
     return priors.query("var == @var")[metric].iloc[0]
 
-def simulate_election_states(model, states_dict, x_matrix, trace):
+def flat_coefficient_priors(sigma, sigmas=None):
+    '''
+    N(0, sigma) priors for beta in COVARIATES order, sigmas overrides
+    the sd of individual covariates
+    '''
+    mus = np.zeros(len(COVARIATES))
+    sigmas = sigmas or {}
+    sds = np.array([sigmas.get(name, sigma) for name in COVARIATES], dtype=float)
+    return mus, sds
+
+def stored_coefficient_priors(priors):
+    '''
+    beta priors in COVARIATES order from the stored posterior summaries
+    '''
+    mus = np.array([load_priors(name, 'mean', priors) for name in COVARIATES])
+    sds = np.array([load_priors(name, 'sd', priors) for name in COVARIATES])
+    return mus, sds
+
+def design_data(x_matrix):
+    '''
+    the covariate matrix (columns in COVARIATES order) and the state id
+    vector of x_matrix, which is either the frame from load_polling_data
+    or the (X, states) arrays from load_design_matrix; arrays are used
+    as they are, so memory-mapped ones are not copied here
+    '''
+    if isinstance(x_matrix, tuple):
+        X, states = x_matrix
+        return np.asarray(X, dtype=float), np.asarray(states, dtype=np.int64)
+    return x_matrix[list(COVARIATES)].to_numpy(dtype=float), x_matrix.state.values
+
+def linear_predictor(x_matrix, b0, beta_mu, beta_sigma):
+    '''
+    b0[state] + X @ beta in the current model, with the design matrix as one
+    MutableData "X" and a single coefficient vector "beta" over the
+    covariate dim (the model needs coords={'covariate': list(COVARIATES)})
+    '''
+    X_data, state_data = design_data(x_matrix)
+    X = pm.MutableData("X", X_data)
+    states = pm.MutableData("states", state_data)
+    beta = pm.Normal("beta", mu=beta_mu, sigma=beta_sigma, dims="covariate")
+    return b0[states] + pm.math.dot(X, beta)
+
+# the poll each state's prediction is made for
+STANDARD_POLL = {
+    'Live Phone': 0,
+    'Online Panel': 1,
+    'Other': 0,
+    'month': None, # the latest month in the data
+    'rep_poll': 1,
+    'sample_size': 2000,
+    'MultiCandidate': 1,
+    'lv': 1,
+    'rv': 0,
+    'grade': 1
+}
+
+def sample_state_predictions(model, states_dict, x_matrix, trace):
+    '''
+    posterior predictive draws of each state's vote share for a
+    standard poll at the latest month
+
+    the prior values trace was fitted with are restored from its
+    constant_data first, since fit_model shares the model with later fits
+    that swap them; otherwise the parameters would be redrawn from the
+    prior of the latest fit
+    '''
+    X_data, _ = design_data(x_matrix)
+    standard_poll = dict(STANDARD_POLL, month=X_data[:, list(COVARIATES).index('month')].max())
+    X = np.tile([standard_poll[name] for name in COVARIATES], (len(states_dict), 1)).astype(float)
+
+    fitted_priors = {
+        name: trace.constant_data[name].values
+        for name in trace.constant_data.data_vars
+        if name in model.named_vars and name not in ('X', 'states', 'Y_obs')
+    }
+
     with model:
+        pm.set_data(fitted_priors)
         pm.set_data({
-            "X1": [0 for x in range(len(states_dict))],
-            "X2": [1 for x in range(len(states_dict))],
-            "X3": [0 for x in range(len(states_dict))],
-            "X4": [x_matrix['month'].max() for x in range(len(states_dict))],
-            "X5": [1 for x in range(len(states_dict))],
-            "X6": [2000 for x in range(len(states_dict))],
-            "X7": [1 for x in range(len(states_dict))],
-            "X8": [1 for x in range(len(states_dict))],
-            "X9": [0 for x in range(len(states_dict))],
-            "X10": [1 for x in range(len(states_dict))],
+            "X": X,
             'Y_obs': [-1000 for x in range(len(states_dict))],
             'states': list(states_dict.values())
         })
@@ -162,278 +546,881 @@ def simulate_election_states(model, states_dict, x_matrix, trace):
             trace, predictions=True, random_seed=1
         )
 
-        pred_matrix = pp['predictions']['y'].mean(('chain'))
+    return pp
 
-        results = {}
+def load_fallback_states(states_to_drop):
+    '''
+    99/1 win percentages for states not in the polling dataset,
+    based on the final 2020 polling averages
 
-        for i in range(pred_matrix.shape[1]):
-            val = np.divide(np.sum(np.greater(pred_matrix[:,i],0.5)),len(pred_matrix[:,1]))
-            val = round(float(val)*100,2)
-            results[list(states_dict.keys())[i]] = val  
-        
-        # Add in states not in polling dataset
-        file_url = 'https://projects.fivethirtyeight.com/2020-general-data/presidential_poll_averages_2020.csv'
+    served from the bundled reference table only, so this never touches
+    the network or rewrites the table; unpolled states the table does not
+    cover are left out with a warning (regenerate it with
+    `python reference_data.py`)
+    '''
+    fallback = fallback_states_2020()
+    missing = [
+        state for state in EC_DATA
+        if state != 'National' and state not in states_to_drop and state not in fallback
+    ]
+    if missing:
+        warnings.warn(
+            f"No 2020 fallback for unpolled {', '.join(missing)}, run `python reference_data.py` "
+            "to regenerate data/reference/fallback_states_2020.csv"
+        )
 
-        old_data = pd.read_csv(file_url).query("candidate_name == 'Donald Trump' and modeldate == '11/3/2020'")[['state', 'pct_estimate']] \
-            .assign(pct_estimate = lambda x:np.where(x.pct_estimate>50,99,1))
-        
-        old_data = pd.concat([old_data,pd.DataFrame({'state':"NE-3", 'pct_estimate':99}, index=[0])])
+    return {state:pct for state, pct in fallback.items() if state not in states_to_drop}
 
-        states_to_drop = list(results.keys())
+def simulate_election_states(model, states_dict, x_matrix, trace):
+    pp = sample_state_predictions(model, states_dict, x_matrix, trace)
 
-        old_data = old_data.loc[~old_data.state.isin(states_to_drop),:]
-        
-        for i,row in old_data.iterrows():
-            results[row.iloc[0]] = row.iloc[1]
-        
-        return {k:v for k,v in results.items() if k != 'National'}
+    pred_matrix = pp['predictions']['y'].mean(('chain'))
 
-def fit_bhm(y_vec, x_matrix, state_dict):
-    n_state = len(state_dict)
-    state_r = x_matrix.state.values
+    results = {}
 
-    with pm.Model() as model:
+    for i in range(pred_matrix.shape[1]):
+        val = np.divide(np.sum(np.greater(pred_matrix[:,i],0.5)),len(pred_matrix[:,1]))
+        val = round(float(val)*100,2)
+        results[list(states_dict.keys())[i]] = val  
+    
+    # Add in states not in polling dataset
+    results.update(load_fallback_states(list(results.keys())))
+    
+    return {k:v for k,v in results.items() if k != 'National'}
 
-        # b0 - intercept 
-        mu_b0 = pm.Normal('mu_b0', 0, sigma=1)
-        sigma_b0 = pm.HalfCauchy('sigma_b0', 5)
-        
-        # Random intercepts as offsets
-        a_offset = pm.Normal('a_offset', mu=0, sigma=1, shape=n_state)
-        b0 = pm.Deterministic("Intercept", mu_b0 + a_offset * sigma_b0)
-
-        # Setting data
-        X1 = pm.MutableData("X1", x_matrix['Live Phone'].values)
-        X2 = pm.MutableData("X2", x_matrix['Online Panel'].values)
-        X3 = pm.MutableData("X3", x_matrix['Other'].values)
-        X4 = pm.MutableData("X4", x_matrix['month'].values)
-        X5 = pm.MutableData("X5", x_matrix['rep_poll'].values)
-        X6 = pm.MutableData("X6", x_matrix['sample_size'].values)
-        X7 = pm.MutableData("X7", x_matrix['MultiCandidate'].values)
-        X8 = pm.MutableData("X8", x_matrix['lv'].values)
-        X9 = pm.MutableData("X9", x_matrix['rv'].values)
-        X10 = pm.MutableData("X10", x_matrix['grade'].values)
-        Y_obs = pm.MutableData("Y_obs", y_vec)
-        states = pm.MutableData("states", state_r)
-
-        b1 = pm.Normal("Live Phone", mu=0, sigma=0.1)
-        b2 = pm.Normal("Online Panel", mu=0, sigma=0.1)
-        b3 = pm.Normal("Other", mu=0, sigma=0.1)
-        b4 = pm.Normal("month", mu=0, sigma=0.1)
-        b5 = pm.Normal("rep_poll", mu=0, sigma=1)
-        b6 = pm.Normal("sample_size", mu=0, sigma=1)
-        b7 = pm.Normal("MultiCandidate", mu=0, sigma=1)
-        b8 = pm.Normal("lv", mu=0, sigma=1)
-        b9 = pm.Normal("rv", mu=0, sigma=1)
-        b10 = pm.Normal("grade", mu=0, sigma=1)
-
-        formula =  (
-            b0[states] + 
-            b1*X1 + 
-            b2*X2 + 
-            b3*X3 + 
-            b4*X4 + 
-            b5*X5 +
-            b6*X6 +
-            b7*X7 +
-            b8*X8 +
-            b9*X9 +
-            b10*X10
-        )
-        
-        s = pm.HalfNormal('error',sigma =1)
+def simulate_election_posterior(model, states_dict, x_matrix, trace, pp=None):
+    '''
+    electoral vote distribution straight from the joint posterior predictive
+    draws: every (chain, draw) is turned into an electoral vote total with one
+    matrix-vector product, so correlations between states in the posterior
+    are kept and there is no second sampling stage
 
-        obs = pm.Normal('y', mu = formula, sigma=s, observed=Y_obs)
+    states not in the polling dataset keep their 99/1 fallback and are
+    added exactly by convolution
 
-        trace = pm.sample(1000, tune=1000, cores=1)
+    returns the probability of winning and the electoral vote probability
+    mass function (index = electoral votes)
+    '''
+    if pp is None:
+        pp = sample_state_predictions(model, states_dict, x_matrix, trace)
+
+    draws = pp['predictions']['y'].values
+    draws = draws.reshape(-1, draws.shape[-1])
+
+    # prediction columns follow the order of states_dict
+    votes = ev_vector(states_dict)[list(states_dict.values())]
+    points = np.greater(draws, 0.5) @ votes
+
+    fallback = {k:v for k,v in load_fallback_states(list(states_dict.keys())).items() if k != 'National'}
+    fallback_probs, fallback_votes = _align_preds(fallback)
+
+    bins = _ev_bins(np.concatenate([votes, fallback_votes]))
+    pmf = np.convolve(
+        np.bincount(points, minlength=bins)/draws.shape[0],
+        ev_distribution(fallback_probs, fallback_votes)
+    )[:bins]
+
+    trump_won = pmf[270:].sum()
+
+    return trump_won, pmf
+
+# flat prior values of each likelihood; scale is the prior sd of the
+# likelihood's own scale parameter (error for normal, sd for beta_sd)
+FLAT_PRIORS = {
+    'normal': {
+        'sigma_b0': 5, 'a_offset_sd': 1, 'scale': 1,
+        'beta_sd': 1, 'beta_sds': {'Live Phone': 0.1, 'Online Panel': 0.1, 'Other': 0.1, 'month': 0.1}
+    },
+    'beta': {
+        'sigma_b0': 1, 'a_offset_sd': 10, 'scale': None,
+        'beta_sd': 20, 'beta_sds': {'month': 0.1, 'sample_size': 10}
+    },
+    'beta_sd': {
+        'sigma_b0': 1, 'a_offset_sd': 10, 'scale': 35,
+        'beta_sd': 1, 'beta_sds': {'month': 0.1, 'sample_size': 10}
+    }
+}
+SCALE_VARS = {'normal': 'error', 'beta': None, 'beta_sd': 'sd'}
+NUTS_INIT = {
+    'normal': {'init': 'jitter+adapt_diag'},
+    'beta': {'init': 'adapt_diag', 'target_accept': 0.9},
+    'beta_sd': {'init': 'adapt_diag', 'target_accept': 0.9}
+}
+
+# (model, NUTS step) per model structure, the step holds the compiled
+# logp and gradient functions
+_MODEL_CACHE = {}
+
+def model_priors(likelihood, state_dict, priors=None, stored_offsets=False):
+    '''
+    prior values of the factory model as data updates
+
+    flat priors by default; with priors (a priors.csv frame) the intercept,
+    coefficient and scale priors come from the stored posterior summaries,
+    stored_offsets also takes the state offsets from them
+    '''
+    flat = FLAT_PRIORS[likelihood]
+    n_state = n_states(state_dict)
+
+    values = {
+        'mu_b0_mu': 0.0,
+        'mu_b0_sd': 1.0,
+        'sigma_b0_beta': float(flat['sigma_b0']),
+        'a_offset_mu': np.zeros(n_state),
+        'a_offset_sd': np.full(n_state, float(flat['a_offset_sd']))
+    }
+    values['beta_mu'], values['beta_sd'] = flat_coefficient_priors(flat['beta_sd'], flat['beta_sds'])
+    if flat['scale'] is not None:
+        values['scale_sd'] = float(flat['scale'])
+
+    if priors is not None:
+        values['mu_b0_mu'] = load_priors('mu_b0', 'mean', priors)
+        values['mu_b0_sd'] = load_priors('mu_b0', 'sd', priors)
+        values['sigma_b0_beta'] = load_priors('sigma_b0', 'mean', priors)
+        values['beta_mu'], values['beta_sd'] = stored_coefficient_priors(priors)
+        if flat['scale'] is not None:
+            values['scale_sd'] = load_priors(SCALE_VARS[likelihood], 'mean', priors)
+        if stored_offsets:
+            values['a_offset_mu'], values['a_offset_sd'] = offset_priors(state_dict, priors, n_state)
+
+    return values
+
+def build_model(y_vec, x_matrix, n_state, likelihood='normal', prior_values=None):
+    '''
+    hierarchical poll model with state intercepts and X @ beta; all prior
+    values are MutableData, so one compiled model serves every prior source
+    '''
+    if likelihood not in FLAT_PRIORS:
+        raise ValueError(f"Unknown likelihood {likelihood}, use one of {list(FLAT_PRIORS)}")
+
+    with pm.Model(coords={'covariate':list(COVARIATES)}) as model:
+
+        # prior values
+        mu_b0_mu = pm.MutableData('mu_b0_mu', prior_values['mu_b0_mu'])
+        mu_b0_sd = pm.MutableData('mu_b0_sd', prior_values['mu_b0_sd'])
+        sigma_b0_beta = pm.MutableData('sigma_b0_beta', prior_values['sigma_b0_beta'])
+        a_offset_mu = pm.MutableData('a_offset_mu', prior_values['a_offset_mu'])
+        a_offset_sd = pm.MutableData('a_offset_sd', prior_values['a_offset_sd'])
+        beta_mu = pm.MutableData('beta_mu', prior_values['beta_mu'], dims='covariate')
+        beta_sd = pm.MutableData('beta_sd', prior_values['beta_sd'], dims='covariate')
 
-        return model, trace
-    
-def fit_bhm_custom_belief(y_vec, x_matrix, state_dict, priors):
-    n_state = len(state_dict)
-    state_r = x_matrix.state.values
-
-    with pm.Model() as model:
-
-        # b0 - intercept 
-        mu_b0 = pm.Normal(
-            'mu_b0', 
-            load_priors('mu_b0', 'mean', priors),
-            sigma=load_priors('mu_b0', 'sd', priors))
-        sigma_b0 = pm.HalfCauchy('sigma_b0', load_priors('sigma_b0', 'mean', priors))
-        
         # Random intercepts as offsets
-        mns = []
-        sds = []
-        
-        for state,num in state_dict.items():
-            if not priors.query('state == @state').empty:
-                mn = priors.query('state == @state')['mean'].iloc[0]
-                sd = priors.query('state == @state')['sd'].iloc[0]
-            else:
-                mn = 0,
-                sd = 1
-            mns.append(mn)
-            sds.append(sd)
-        
-        a_offset = pm.Normal('a_offset', mu=mns, sigma=sds, shape=n_state)
-        b0 = pm.Deterministic("Intercept", mu_b0 + a_offset * sigma_b0)
-
-        # Setting data
-        X1 = pm.MutableData("X1", x_matrix['Live Phone'].values)
-        X2 = pm.MutableData("X2", x_matrix['Online Panel'].values)
-        X3 = pm.MutableData("X3", x_matrix['Other'].values)
-        X4 = pm.MutableData("X4", x_matrix['month'].values)
-        X5 = pm.MutableData("X5", x_matrix['rep_poll'].values)
-        X6 = pm.MutableData("X6", x_matrix['sample_size'].values)
-        X7 = pm.MutableData("X7", x_matrix['MultiCandidate'].values)
-        X8 = pm.MutableData("X8", x_matrix['lv'].values)
-        X9 = pm.MutableData("X9", x_matrix['rv'].values)
-        X10 = pm.MutableData("X10", x_matrix['grade'].values)
+        mu_b0 = pm.Normal('mu_b0', mu_b0_mu, sigma=mu_b0_sd)
+        sigma_b0 = pm.HalfCauchy('sigma_b0', sigma_b0_beta)
+        a_offset = pm.Normal('a_offset', mu=a_offset_mu, sigma=a_offset_sd, shape=n_state)
+        b0 = pm.Deterministic("Intercept", mu_b0 + a_offset*sigma_b0)
+
+        # Setting data, X @ beta
         Y_obs = pm.MutableData("Y_obs", y_vec)
-        states = pm.MutableData("states", state_r)
-
-        b1 = pm.Normal("Live Phone", mu=load_priors('Live Phone', 'mean', priors), sigma=load_priors('Live Phone', 'sd', priors))
-        b2 = pm.Normal("Online Panel", mu=load_priors('Online Panel', 'mean', priors), sigma=load_priors('Online Panel', 'sd', priors))
-        b3 = pm.Normal("Other", mu=load_priors('Other', 'mean', priors), sigma=load_priors('Other', 'sd', priors))
-        b4 = pm.Normal("month", mu=load_priors('month', 'mean', priors), sigma=load_priors('month', 'sd', priors))
-        b5 = pm.Normal("rep_poll", mu=load_priors('rep_poll', 'mean', priors), sigma=load_priors('rep_poll', 'sd', priors))
-        b6 = pm.Normal("sample_size", mu=load_priors('sample_size', 'mean', priors), sigma=load_priors('sample_size', 'sd', priors))
-        b7 = pm.Normal("MultiCandidate", mu=load_priors('MultiCandidate', 'mean', priors), sigma=load_priors('MultiCandidate', 'sd', priors))
-        b8 = pm.Normal("lv", mu=load_priors('lv', 'mean', priors), sigma=load_priors('lv', 'sd', priors))
-        b9 = pm.Normal("rv", mu=load_priors('rv', 'mean', priors), sigma=load_priors('rv', 'sd', priors))
-        b10 = pm.Normal("grade", mu=load_priors('grade', 'mean', priors), sigma=load_priors('grade', 'sd', priors))
-
-        formula =  (
-            b0[states] + 
-            b1*X1 + 
-            b2*X2 + 
-            b3*X3 + 
-            b4*X4 + 
-            b5*X5 +
-            b6*X6 +
-            b7*X7 +
-            b8*X8 +
-            b9*X9 +
-            b10*X10
-        )
-        
-        s = pm.HalfNormal('error', sigma =load_priors('error', 'mean', priors))
+        formula = linear_predictor(x_matrix, b0, beta_mu, beta_sd)
+
+        if likelihood == 'normal':
+            scale_sd = pm.MutableData('scale_sd', prior_values['scale_sd'])
+            s = pm.HalfNormal('error', sigma=scale_sd)
+
+            obs = pm.Normal('y', mu = formula, sigma=s, observed=Y_obs)
+
+        elif likelihood == 'beta':
+            Mu =  pm.invlogit(formula)
+            Phi = pm.Normal('phi', 100)
+
+            A = pm.Deterministic('A', pm.math.switch(Mu*Phi <= 0, -np.inf, Mu*Phi))
+            B = pm.Deterministic('B', pm.math.switch(Phi-A <= 0, -np.inf, Phi-A))
+
+            obs = pm.Beta('y', alpha = A, beta = B,observed=Y_obs)
+
+        else:
+            Mu =  pm.invlogit(formula)
+            scale_sd = pm.MutableData('scale_sd', prior_values['scale_sd'])
+            sd = pm.HalfNormal('sd', sigma = scale_sd)
+            Phi = ((Mu * (1 - Mu)) / (sd**2 - 1))
+
+            A = Mu*Phi
+            B = Phi-A
+
+            obs = pm.Beta('y', alpha = A, beta = B,observed=Y_obs)
+
+    return model
+
+def fit_model(y_vec, x_matrix, state_dict, likelihood='normal', priors=None, stored_offsets=False,
+              draws=1000, tune=1000, **sample_kwargs):
+    '''
+    fits the poll model with the given likelihood ('normal', 'beta' or
+    'beta_sd') and prior source (flat when priors is None, else the
+    stored priors, see model_priors); x_matrix is the frame from
+    load_polling_data or the (X, states) arrays from load_design_matrix
+
+    models and their NUTS steps are cached by likelihood and shapes
+    (states and covariates, the number of polls is data), so repeated fits
+    only swap data and prior values instead of recompiling the logp and
+    gradient; the returned model is shared with later fits of the same
+    structure, sample_state_predictions restores the prior values of the
+    trace it is given
+    '''
+    n_state = n_states(state_dict)
+    prior_values = model_priors(likelihood, state_dict, priors, stored_offsets)
+    key = (likelihood, n_state, len(COVARIATES))
+
+    if key not in _MODEL_CACHE:
+        model = build_model(y_vec, x_matrix, n_state, likelihood, prior_values)
+        with model:
+            _, step = pm.init_nuts(chains=1, **NUTS_INIT[likelihood])
+        _MODEL_CACHE[key] = model, step
+
+    model, step = _MODEL_CACHE[key]
+    X_data, state_data = design_data(x_matrix)
 
-        obs = pm.Normal('y', mu = formula, sigma=s, observed=Y_obs)
+    with model:
+        pm.set_data({
+            'X': X_data,
+            'states': state_data,
+            'Y_obs': y_vec,
+            **prior_values
+        })
 
-        trace = pm.sample(1000, tune=1000, cores=1)
+        # pm.sample resets the step's tuning before each chain
+        trace = pm.sample(draws, tune=tune, cores=1, step=step, **sample_kwargs)
 
-        return model, trace
+    return model, trace
 
-def simulate_election(preds, simulation_num):
+def fit_bhm(y_vec, x_matrix, state_dict):
+    return fit_model(y_vec, x_matrix, state_dict, 'normal')
+    
+def fit_bhm_custom_belief(y_vec, x_matrix, state_dict, priors):
+    return fit_model(y_vec, x_matrix, state_dict, 'normal', priors, stored_offsets=True)
+
+def simulate_election(preds, simulation_num, seed=None, return_array=False):
     '''
     given a dict with each state's probability of one candidate winning
     will return number of simulations won by that candidate
+
+    simulations are drawn as batched simulations x states matrices from a
+    numpy Generator (seed can be an int or a Generator); set return_array
+    to get the raw array of electoral votes instead of a DataFrame
     '''
-    import numpy as np
-    import pandas as pd
-    
-    ec_data = {'Arizona': 11,
-    'Georgia': 16,
-    'Pennsylvania': 19,
-    'Michigan': 15,
-    'Nevada': 6,
-    'Wisconsin': 10,
-    'North Carolina': 3,
-    'Ohio': 17,
-    'Florida': 30,
-    'New Hampshire': 4,
-    'New York': 28,
-    'California': 54,
-    'Iowa': 6,
-    'Tennessee': 11,
-    'Virginia': 13,
-    'Missouri': 10,
-    'Texas': 40,
-    'Colorado': 10,
-    'Montana': 4,
-    'Washington': 12,
-    'Illinois': 19,
-    'Connecticut': 7,
-    'Oklahoma': 7,
-    'New Mexico': 5,
-    'Kansas': 6,
-    'Massachusetts': 11,
-    'Minnesota': 10,
-    'Kentucky': 8,
-    'Alaska': 3,
-    'Oregon': 8,
-    'Nebraska': 2,
-    'South Carolina': 9,
-    'Maryland': 10,
-    'Rhode Island': 4,
-    'Arkansas': 6,
-    'South Dakota': 3,
-    'Louisiana': 8,
-    'Mississippi': 6,
-    'Maine': 2,
-    'Utah': 6,
-    'Idaho': 4,
-    'Alabama': 9,
-    'West Virginia': 4,
-    'Indiana': 11,
-    'North Dakota': 3,
-    'Wyoming': 3,
-    'Vermont': 3,
-    'New Jersey': 14,
-    'National': 1,
-    'NE-1': 1,
-    'NE-2': 1,
-    'NE-3':1,
-    'ME-2': 1,
-    'ME-1': 1,
-    'Hawaii': 4,
-    'District of Columbia': 3,
-    'Delaware': 3}
-    
-    def simulate_state(prob, points):
-        prob = prob/100
-        trump_win = np.random.choice([0,1], p=[1-prob, prob])
-        return trump_win*points
-    
-    winner = []
-    points = []
-    sim_num = []
-    
-    for _ in range(simulation_num):
-        votes = [simulate_state(prob,ec_data[state]) for state,prob in preds.items()]
-        tot_votes = sum(votes)
-        winner.append(np.where(tot_votes>=270, 1,0))
-        points.append(tot_votes)
-    
+    probs, votes = _align_preds(preds)
+
+    rng = np.random.default_rng(seed)
+    points = np.concatenate(list(_simulate_points(probs, votes, simulation_num, rng)))
+
+    trump_won = np.mean(points >= 270)
+
+    if return_array:
+        return trump_won, points
+
     data = pd.DataFrame({
-        'winner':winner,
+        'winner':(points >= 270).astype('int'),
         'points':points
     })
-    
-    trump_won = sum(data.winner)/data.shape[0]
-    
+
     return trump_won, data
 
-def get_credible_interval(sim_data:pd.DataFrame, conf_level:int=95):
+def _simulate_wins(probs, simulation_num, rng, chunk_size=100000):
+    '''
+    yields the simulations x states win matrix in chunks of chunk_size rows
+    '''
+    # float32 uniforms are plenty for win probabilities reported to two decimals
+    probs = np.asarray(probs, dtype=np.float32)
+
+    for start in range(0, simulation_num, chunk_size):
+        n = min(chunk_size, simulation_num - start)
+        yield rng.random((n, probs.size), dtype=np.float32) < probs
+
+def _simulate_points(probs, votes, simulation_num, rng, chunk_size=100000):
+    '''
+    yields the electoral votes won by the candidate in each simulation,
+    chunk_size simulations at a time
+    '''
+    votes = np.asarray(votes, dtype=np.float32)
+
+    for wins in _simulate_wins(probs, simulation_num, rng, chunk_size):
+        yield (wins @ votes).astype(np.int64)
+
+def _align_preds(preds):
     '''
-    Sample from the 50,000 daily simulations finding the upper and lower bounds given percentile(conf_level)
+    turns a dict of state win percentages into aligned arrays of
+    win probabilities and electoral votes
+    '''
+    probs = np.fromiter(preds.values(), dtype=float, count=len(preds))/100
+    votes = EC_VOTES[[EC_INDEX[state] for state in preds]]
+    return probs, votes
+
+def _ev_bins(votes):
+    '''
+    number of bins needed to index electoral vote totals from 0 to 538
+    '''
+    return max(538, int(np.sum(votes))) + 1
+
+def ev_distribution(probs, votes):
+    '''
+    exact probability mass function of the electoral votes won, assuming
+    independent states, via a dynamic program over the states
+    (a Poisson-binomial convolution weighted by electoral votes)
+
+    probs can carry leading dimensions (e.g. scenarios x states), in which
+    case one distribution is returned per row
+    '''
+    probs = np.asarray(probs, dtype=float)
+    pmf = np.zeros(probs.shape[:-1] + (_ev_bins(votes),))
+    pmf[..., 0] = 1
+
+    for i, vote in enumerate(votes):
+        # a state without electoral votes (e.g. National) cannot move the total
+        if vote == 0:
+            continue
+        prob = probs[..., i, None]
+        next_pmf = pmf*(1-prob)
+        next_pmf[..., vote:] += pmf[..., :-vote]*prob
+        pmf = next_pmf
+
+    return pmf
+
+def simulate_election_exact(preds):
+    '''
+    exact counterpart of simulate_election: returns the probability the
+    candidate wins (270+), the probability of a 269-269 tie and the
+    full electoral vote probability mass function (index = electoral votes)
+    '''
+    probs, votes = _align_preds(preds)
+    pmf = ev_distribution(probs, votes)
+
+    trump_won = pmf[270:].sum()
+    tie = pmf[269]
+
+    return trump_won, tie, pmf
+
+def simulate_election_metrics(preds, simulation_num, seed=None, chunk_size=100000):
+    '''
+    runs the simulations once and reports, next to the share of simulations
+    won, per state metrics computed from the same simulations x states matrix:
+
+    tipping_point: share of simulations in which the state is the tipping
+        point, i.e. the state that takes the winner past the line when the
+        winner's states are added from safest to closest (states are ranked
+        by win probability since the simulation has no vote margins)
+    swing: share of simulations whose winner changes if only that state flips
+    ev_variance: variance of the electoral votes the state contributes
+    '''
+    probs, votes = _align_preds(preds)
+    n_cols = probs.size
+    total = votes.sum()
+    ev = votes.astype(np.float32)
+
+    # states from safest Trump to safest Harris
+    order = np.argsort(-probs, kind='stable')
+    trump_ev = ev[order]
+    harris_ev = ev[order][::-1]
+
+    trump_wins = 0
+    state_wins = np.zeros(n_cols, dtype=np.int64)
+    tipping = np.zeros(n_cols, dtype=np.int64)
+    swing = np.zeros(n_cols, dtype=np.int64)
+
+    rng = np.random.default_rng(seed)
+    for wins in _simulate_wins(probs, simulation_num, rng, chunk_size):
+        points = wins @ ev
+        won = points >= 270
+        trump_wins += won.sum()
+        state_wins += wins.sum(axis=0)
+
+        # flipping a state moves its electoral votes to the other candidate
+        flipped = points[:, None] + np.where(wins, -ev, ev)
+        swing += ((flipped >= 270) != won[:, None]).sum(axis=0)
+
+        ordered = wins[:, order]
+        trump_cum = np.cumsum(ordered*trump_ev, axis=1)
+        harris_cum = np.cumsum(~ordered[:, ::-1]*harris_ev, axis=1)
+        trump_tip = order[np.argmax(trump_cum >= 270, axis=1)]
+        harris_tip = order[::-1][np.argmax(harris_cum > total - 270, axis=1)]
+        tipping += np.bincount(np.where(won, trump_tip, harris_tip), minlength=n_cols)
+
+    state_rate = state_wins/simulation_num
+    metrics = pd.DataFrame({
+        'tipping_point': tipping/simulation_num,
+        'swing': swing/simulation_num,
+        'ev_variance': votes**2*state_rate*(1 - state_rate)
+    }, index=list(preds.keys()))
+
+    trump_won = trump_wins/simulation_num
+
+    return trump_won, metrics
+
+def simulate_election_variance_reduced(preds, simulation_num, method:str='antithetic', seed=None,
+                                       n_strata_states:int=4, n_replicates:int=16, chunk_size=100000):
+    '''
+    estimates the share of simulations won with a variance reduction method
+    and returns it together with its Monte Carlo standard error
+
+    method is one of
+    'plain': independent draws, as in simulate_election
+    'antithetic': each uniform draw u is paired with 1 - u
+    'qmc': n_replicates independently scrambled Sobol sequences, each of
+        2**m points with m the largest that keeps within simulation_num
+    'stratified': simulations are split by the outcomes of the
+        n_strata_states most uncertain states (by electoral vote variance),
+        proportionally to the probability of each combination
+    '''
+    probs, votes = _align_preds(preds)
+    ev = votes.astype(np.float32)
+    rng = np.random.default_rng(seed)
+
+    if method == 'plain':
+        hist = _simulate_histogram(probs, votes, simulation_num, rng, chunk_size)
+        trump_won = hist[270:].sum()/simulation_num
+        std_error = np.sqrt(trump_won*(1 - trump_won)/simulation_num)
+
+    elif method == 'antithetic':
+        n_pairs = max(1, simulation_num//2)
+        pair_sum = 0.0
+        pair_sq_sum = 0.0
+        for start in range(0, n_pairs, chunk_size):
+            n = min(chunk_size, n_pairs - start)
+            uniforms = rng.random((n, probs.size), dtype=np.float32)
+            won = ((uniforms < probs) @ ev >= 270).astype(float)
+            won_antithetic = ((1 - uniforms < probs) @ ev >= 270).astype(float)
+            pair_mean = (won + won_antithetic)/2
+            pair_sum += pair_mean.sum()
+            pair_sq_sum += (pair_mean**2).sum()
+        trump_won = pair_sum/n_pairs
+        pair_var = max(pair_sq_sum/n_pairs - trump_won**2, 0)*n_pairs/max(n_pairs - 1, 1)
+        std_error = np.sqrt(pair_var/n_pairs)
+
+    elif method == 'qmc':
+        # Sobol points are balanced in blocks of powers of two, so each
+        # replicate gets the largest power of two within its share of the budget
+        m = max(1, int(np.floor(np.log2(max(simulation_num/n_replicates, 2)))))
+        estimates = []
+        for child in rng.spawn(n_replicates):
+            sobol = qmc.Sobol(d=probs.size, scramble=True, seed=child)
+            block = min(2**m, 2**16)
+            wins = 0
+            for _ in range(2**m//block):
+                uniforms = sobol.random(block)
+                wins += ((uniforms < probs) @ ev >= 270).sum()
+            estimates.append(wins/2**m)
+        trump_won = np.mean(estimates)
+        std_error = np.std(estimates, ddof=1)/np.sqrt(n_replicates)
+
+    elif method == 'stratified':
+        strata_states = np.argsort(-votes**2*probs*(1 - probs), kind='stable')[:n_strata_states]
+        rest = np.setdiff1d(np.arange(probs.size), strata_states)
+        # every combination of outcomes in the stratification states
+        outcomes = (np.arange(2**strata_states.size)[:, None] >> np.arange(strata_states.size)) & 1
+        weights = np.prod(
+            np.where(outcomes == 1, probs[strata_states], 1 - probs[strata_states]), axis=1
+        )
+        allocation = np.where(weights > 0, np.maximum(2, np.round(simulation_num*weights)), 0).astype(int)
+
+        trump_won = 0.0
+        variance = 0.0
+        for outcome, weight, n in zip(outcomes, weights, allocation):
+            if n == 0:
+                continue
+            fixed_points = outcome @ votes[strata_states]
+            hist = _simulate_histogram(probs[rest], votes[rest], n, rng, chunk_size)
+            stratum_won = hist[max(270 - fixed_points, 0):].sum()/n
+            trump_won += weight*stratum_won
+            variance += weight**2*stratum_won*(1 - stratum_won)/n
+        std_error = np.sqrt(variance)
+
+    else:
+        raise ValueError(f"Unknown variance reduction method: {method}")
+
+    return trump_won, std_error
+
+def simulate_rare_event(preds, event:str='tie', simulation_num:int=100000, threshold:int=400,
+                        conf_level:int=95, seed=None, chunk_size=100000):
+    '''
+    importance sampling estimate of the probability of a rare electoral
+    vote outcome: 'tie' (269-269), 'trump_landslide' or 'harris_landslide'
+    (more than threshold electoral votes)
+
+    state probabilities are exponentially tilted so the expected electoral
+    vote total sits in the target region, and every draw is reweighted by
+    its likelihood ratio, which keeps the estimate unbiased
+
+    returns the estimate, its standard error and the conf_level interval
     '''
     assert conf_level > 0 and conf_level < 100
-    conf_data = [sum(sim_data.winner.sample(n=100) == "Trump")/100 for x in range(1000)]
-    conf_data = np.array(conf_data)
-    s = (100 - conf_level)/2
-    UB = 100 - s
-    LB = s
-    res = np.percentile(conf_data, [LB, UB])
-    return res[0], res[1]
+    probs, votes = _align_preds(preds)
+    total = votes.sum()
+
+    # electoral vote range of the event and the total to tilt towards
+    if event == 'tie':
+        low, high = 269, 269
+        target = 269
+    elif event == 'trump_landslide':
+        low, high = threshold + 1, total
+        target = low
+    elif event == 'harris_landslide':
+        low, high = 0, total - threshold - 1
+        target = high
+    else:
+        raise ValueError(f"Unknown event: {event}")
+
+    def tilt(theta):
+        return expit(logit(probs) + theta*votes)
+
+    try:
+        theta = brentq(lambda theta: tilt(theta) @ votes - target, -2, 2)
+    except ValueError:
+        raise ValueError(f"Cannot tilt the state probabilities towards {target} electoral votes")
+
+    # likelihood ratio of a draw with `points` electoral votes is
+    # exp(-theta*points) * prod(1 - p + p*exp(theta*v))
+    log_norm = np.sum(np.log(1 - probs + probs*np.exp(theta*votes)))
+
+    weighted_sum = 0.0
+    weighted_sq_sum = 0.0
+    rng = np.random.default_rng(seed)
+    for points in _simulate_points(tilt(theta), votes, simulation_num, rng, chunk_size):
+        in_event = (points >= low) & (points <= high)
+        weighted = np.where(in_event, np.exp(log_norm - theta*points), 0)
+        weighted_sum += weighted.sum()
+        weighted_sq_sum += (weighted**2).sum()
+
+    estimate = weighted_sum/simulation_num
+    variance = max(weighted_sq_sum/simulation_num - estimate**2, 0)*simulation_num/(simulation_num - 1)
+    std_error = np.sqrt(variance/simulation_num)
+
+    z = stats.norm.ppf(1 - (1 - conf_level/100)/2)
+    LB, UB = max(estimate - z*std_error, 0), estimate + z*std_error
+
+    return estimate, std_error, LB, UB
+
+@lru_cache(maxsize=32)
+def _state_cholesky(states:tuple, national_corr:float, regional_corr:float):
+    '''
+    cached Cholesky factor of the latent state correlation matrix: a national
+    swing shared by all states, a regional swing shared within each census
+    region and an independent state swing, scaled to unit variance
+    '''
+    regions = np.array([STATE_REGIONS.get(state, state) for state in states])
+    has_region = np.array([state in STATE_REGIONS for state in states])
+    same_region = (regions[:, None] == regions[None, :]) & has_region[:, None]
+
+    cov = national_corr + regional_corr*same_region
+    np.fill_diagonal(cov, 1)
+
+    chol = np.linalg.cholesky(cov).astype(np.float32)
+    chol.flags.writeable = False
+    return chol
+
+def simulate_election_correlated(preds, simulation_num, national_corr:float=0.25, regional_corr:float=0.15,
+                                 seed=None, chunk_size=100000):
+    '''
+    simulate_election with correlated state outcomes: each simulation draws a
+    latent swing for every state from a national + regional covariance
+    (via its cached Cholesky factor) and a state is won when its swing falls
+    below the normal quantile of its win probability, which keeps each
+    state's win probability equal to preds
+
+    returns the share of simulations won and the electoral vote histogram
+    '''
+    assert national_corr >= 0 and regional_corr >= 0 and national_corr + regional_corr < 1
+    probs, votes = _align_preds(preds)
+    chol = _state_cholesky(tuple(preds.keys()), national_corr, regional_corr)
+    cutoffs = stats.norm.ppf(probs).astype(np.float32)
+    ev = votes.astype(np.float32)
+
+    rng = np.random.default_rng(seed)
+    hist = np.zeros(_ev_bins(votes), dtype=np.int64)
+
+    for start in range(0, simulation_num, chunk_size):
+        n = min(chunk_size, simulation_num - start)
+        swings = rng.standard_normal((n, probs.size), dtype=np.float32) @ chol.T
+        points = ((swings < cutoffs) @ ev).astype(np.int64)
+        hist += np.bincount(points, minlength=hist.size)
+
+    trump_won = hist[270:].sum()/simulation_num
+
+    return trump_won, hist
+
+def simulate_scenarios(preds, scenarios:pd.DataFrame, method:str='exact', simulation_num:int=100000, seed=None):
+    '''
+    evaluates many what-if scenarios in one vectorized pass
+
+    scenarios has one row per scenario and one column per overridden state,
+    holding win percentages like preds (NaN keeps the value from preds),
+    e.g. Pennsylvania, Michigan and Wisconsin all set to 100
+
+    method 'exact' runs the electoral vote convolution for all scenarios at
+    once; 'monte_carlo' shares the same uniform draws across scenarios
+    (common random numbers) so differences between scenarios are not noise
+
+    returns a DataFrame indexed like scenarios with the win probability,
+    tie probability and electoral vote summary of each scenario
+    '''
+    unknown = set(scenarios.columns) - set(preds.keys())
+    if unknown:
+        raise ValueError(f"Scenario states not in preds: {sorted(unknown)}")
+
+    probs, votes = _align_preds(preds)
+    overrides = scenarios.reindex(columns=list(preds.keys())).to_numpy(dtype=float)/100
+    scenario_probs = np.where(np.isnan(overrides), probs, overrides)
+
+    if method == 'exact':
+        pmf = ev_distribution(scenario_probs, votes)
+    elif method == 'monte_carlo':
+        n_scenarios, n_cols = scenario_probs.shape
+        bins = _ev_bins(votes)
+        offsets = np.arange(n_scenarios)[:, None]*bins
+        hist = np.zeros(n_scenarios*bins, dtype=np.int64)
+        rng = np.random.default_rng(seed)
+        # keep the scenarios x simulations x states matrix around 20M cells
+        chunk_size = max(1, 20000000//(n_scenarios*n_cols))
+
+        for start in range(0, simulation_num, chunk_size):
+            n = min(chunk_size, simulation_num - start)
+            uniforms = rng.random((n, n_cols), dtype=np.float32)
+            wins = uniforms[None, :, :] < scenario_probs[:, None, :].astype(np.float32)
+            points = (wins @ votes.astype(np.float32)).astype(np.int64)
+            hist += np.bincount((points + offsets).ravel(), minlength=hist.size)
+
+        pmf = hist.reshape(n_scenarios, bins)/simulation_num
+    else:
+        raise ValueError(f"Unknown scenario method: {method}")
+
+    return _summarise_ev(pmf, index=scenarios.index)
+
+def _summarise_ev(pmf, index=None):
+    '''
+    win/tie probabilities and electoral vote mean, sd and 90% range
+    for each row of a (rows x electoral votes) probability mass matrix
+    '''
+    points = np.arange(pmf.shape[-1])
+    mean_ev = pmf @ points
+    cdf = np.cumsum(pmf, axis=-1)
+
+    return pd.DataFrame({
+        'win_prob': pmf[:, 270:].sum(axis=1),
+        'tie_prob': pmf[:, 269],
+        'mean_ev': mean_ev,
+        'sd_ev': np.sqrt(np.maximum(pmf @ points**2 - mean_ev**2, 0)),
+        'ev_5': np.argmax(cdf >= 0.05, axis=1),
+        'ev_95': np.argmax(cdf >= 0.95, axis=1)
+    }, index=index)
+
+def _simulate_histogram(probs, votes, simulation_num, seed, chunk_size=100000, backend='numpy'):
+    '''
+    electoral vote histogram of simulation_num simulations drawn from
+    the stream seeded by seed (used as the per-worker task)
+
+    backend 'numba' runs the compiled kernel when numba is installed and
+    falls back to numpy otherwise
+    '''
+    rng = np.random.default_rng(seed)
+    hist = np.zeros(_ev_bins(votes), dtype=np.int64)
+
+    if backend == 'numba' and numba is not None:
+        # one seed per fixed block of simulations keeps results independent
+        # of the number of threads
+        block_seeds = np.random.SeedSequence(int(rng.integers(2**63))).generate_state(64, dtype=np.uint64)
+        thresholds = np.round(np.asarray(probs, dtype=np.float64)*2**53).astype(np.uint64)
+        return _numba_histogram(
+            thresholds, np.asarray(votes, dtype=np.int64), simulation_num, block_seeds, hist.size
+        )
+    elif backend not in ('numpy', 'numba'):
+        raise ValueError(f"Unknown simulation backend: {backend}")
+
+    for points in _simulate_points(probs, votes, simulation_num, rng, chunk_size):
+        hist += np.bincount(points, minlength=hist.size)
+
+    return hist
+
+if numba is not None:
+    @numba.njit(cache=True, parallel=True)
+    def _numba_histogram(thresholds, votes, simulation_num, block_seeds, bins):
+        # draws, electoral vote sums and binning fused in one pass without
+        # allocating the simulations x states matrix; uniforms come from an
+        # inlined splitmix64 stream per block and a state is won when the top
+        # 53 bits fall below its probability scaled to 2**53
+        n_blocks = block_seeds.size
+        block_size = (simulation_num + n_blocks - 1)//n_blocks
+        block_hists = np.zeros((n_blocks, bins), dtype=np.int64)
+
+        for block in numba.prange(n_blocks):
+            state = block_seeds[block]
+            for _ in range(block*block_size, min((block + 1)*block_size, simulation_num)):
+                points = 0
+                for j in range(thresholds.size):
+                    state += np.uint64(0x9E3779B97F4A7C15)
+                    z = state
+                    z = (z ^ (z >> np.uint64(30)))*np.uint64(0xBF58476D1CE4E5B9)
+                    z = (z ^ (z >> np.uint64(27)))*np.uint64(0x94D049BB133111EB)
+                    z = z ^ (z >> np.uint64(31))
+                    if (z >> np.uint64(11)) < thresholds[j]:
+                        points += votes[j]
+                block_hists[block, points] += 1
+
+        return block_hists.sum(axis=0)
+
+def simulate_election_streaming(preds, simulation_num, seed=None, chunk_size=100000, backend='numpy'):
+    '''
+    constant memory version of simulate_election: simulations are drawn
+    chunk_size at a time and only a running electoral vote histogram is
+    kept, so memory does not grow with simulation_num
+
+    backend='numba' uses a compiled kernel that never builds the
+    simulations x states matrix (numpy is used if numba is not installed)
+
+    returns the share of simulations won and the histogram
+    (index = electoral votes, hist[270:].sum() = simulations won)
+    '''
+    probs, votes = _align_preds(preds)
+    hist = _simulate_histogram(probs, votes, simulation_num, seed, chunk_size, backend)
+
+    trump_won = hist[270:].sum()/simulation_num
+
+    return trump_won, hist
+
+def simulate_election_adaptive(preds, tolerance:float=0.002, max_simulations:int=1000000,
+                               chunk_size:int=5000, seed=None):
+    '''
+    keeps simulating in chunks of chunk_size until the Monte Carlo standard
+    error of the share of simulations won is below tolerance or
+    max_simulations is reached, so lopsided races stop early and close
+    races get the draws they need
+
+    returns the share of simulations won, the electoral vote histogram
+    and the achieved standard error (computed from the (wins + 1)/(n + 2)
+    rate, which stays positive when every simulation has the same winner)
+    '''
+    probs, votes = _align_preds(preds)
+    rng = np.random.default_rng(seed)
+    hist = np.zeros(_ev_bins(votes), dtype=np.int64)
+    simulation_num = 0
+
+    while simulation_num < max_simulations:
+        n = min(chunk_size, max_simulations - simulation_num)
+        hist += _simulate_histogram(probs, votes, n, rng, chunk_size)
+        simulation_num += n
+
+        wins = hist[270:].sum()
+        trump_won = wins/simulation_num
+        # smoothed rate, so a first chunk with a single winner does not
+        # report a zero standard error and stop at 0% / 100%
+        smoothed = (wins + 1)/(simulation_num + 2)
+        std_error = np.sqrt(smoothed*(1 - smoothed)/simulation_num)
+        if std_error < tolerance:
+            break
+
+    return trump_won, hist, std_error
+
+def simulate_election_parallel(preds, simulation_num, seed=None, workers=None, backend='numpy'):
+    '''
+    splits simulation_num simulations across a process pool, each worker
+    drawing from its own SeedSequence child of seed, and merges the
+    workers' electoral vote histograms
+
+    results are reproducible for a given seed and number of workers
+    '''
+    probs, votes = _align_preds(preds)
+
+    workers = workers or os.cpu_count()
+    seeds = np.random.SeedSequence(seed).spawn(workers)
+    shards = [
+        simulation_num//workers + (i < simulation_num % workers)
+        for i in range(workers)
+    ]
+
+    # forking after numba's threading layer has started (backend='numba'
+    # in this process) deadlocks the workers, so start them from a clean
+    # forkserver process instead
+    context = multiprocessing.get_context('forkserver')
+    # import this module once in the server rather than in every worker
+    context.set_forkserver_preload([__name__])
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+        hists = executor.map(
+            _simulate_histogram, repeat(probs), repeat(votes), shards, seeds,
+            repeat(100000), repeat(backend)
+        )
+        hist = np.sum(list(hists), axis=0)
+
+    trump_won = hist[270:].sum()/simulation_num
+
+    return trump_won, hist
+
+def get_credible_interval(sim_data:pd.DataFrame, conf_level:int=95, method:str='bootstrap', seed=None):
+    '''
+    Interval for the share of the daily simulations won by Trump given conf_level
+
+    method is one of 'bootstrap' (binomial draws from the observed win rate),
+    'wilson', 'jeffreys' or 'clopper-pearson'
+    '''
+    winner = sim_data.winner
+    wins = int(((winner == "Trump") | (winner == 1)).sum())
+    return get_win_rate_interval(wins, sim_data.shape[0], conf_level, method, seed)
+
+def get_win_rate_interval(wins:int, simulation_num:int, conf_level:int=95, method:str='bootstrap', seed=None):
+    '''
+    Interval for a win rate of wins out of simulation_num simulations,
+    so it can be used without the simulation rows (e.g. from a histogram)
+    '''
+    assert conf_level > 0 and conf_level < 100
+    alpha = 1 - conf_level/100
+    win_rate = wins/simulation_num
+
+    if method == 'bootstrap':
+        rng = np.random.default_rng(seed)
+        conf_data = rng.binomial(simulation_num, win_rate, size=1000)/simulation_num
+        s = (100 - conf_level)/2
+        LB, UB = np.percentile(conf_data, [s, 100 - s])
+    elif method == 'wilson':
+        z = stats.norm.ppf(1 - alpha/2)
+        center = (win_rate + z**2/(2*simulation_num))/(1 + z**2/simulation_num)
+        half_width = z*np.sqrt(
+            win_rate*(1 - win_rate)/simulation_num + z**2/(4*simulation_num**2)
+        )/(1 + z**2/simulation_num)
+        LB, UB = center - half_width, center + half_width
+    elif method == 'jeffreys':
+        LB, UB = stats.beta.ppf(
+            [alpha/2, 1 - alpha/2], wins + 0.5, simulation_num - wins + 0.5
+        )
+    elif method == 'clopper-pearson':
+        LB = stats.beta.ppf(alpha/2, wins, simulation_num - wins + 1) if wins > 0 else 0.0
+        UB = stats.beta.ppf(1 - alpha/2, wins + 1, simulation_num - wins) if wins < simulation_num else 1.0
+    else:
+        raise ValueError(f"Unknown interval method: {method}")
+
+    return float(LB), float(UB)
+
+def save_ev_histogram(hist, path='./data/elect_college_histogram.npz'):
+    '''
+    saves the electoral vote histogram (index = Trump's electoral votes)
+    with the win totals as a compact binary artifact for the dashboard
+    '''
+    hist = np.asarray(hist, dtype=np.int64)
+    np.savez_compressed(
+        path,
+        hist=hist,
+        trump_wins=hist[270:].sum(),
+        harris_wins=hist[:270].sum()
+    )
+
+def offset_priors(state_dict, priors, n_state):
+    '''
+    prior means and sds of a_offset aligned with the canonical state ids,
+    states without a stored prior (or not polled) get N(0, 1)
+    '''
+    mns = np.zeros(n_state)
+    sds = np.ones(n_state)
+
+    stored = priors.dropna(subset=['state']).set_index('state')
+    for state,num in state_dict.items():
+        if state in stored.index:
+            mns[num] = stored.loc[state, 'mean']
+            sds[num] = stored.loc[state, 'sd']
+
+    return mns, sds
 
 def update_priors(trace, state_dict):
     priors = az.summary(trace, kind="stats", var_names=['~Intercept']) \
         .reset_index() \
         .rename(columns = {'index':'var'}) \
         [['var', 'mean', 'sd']]
+    # beta[Live Phone] -> Live Phone, so stored priors stay keyed by covariate
+    priors['var'] = priors['var'].str.replace(r'^beta\[(.*)\]$', r'\1', regex=True)
     states_df = pd.DataFrame({
         'state' : list(state_dict.keys()),
         'var' : [f'a_offset[{x}]' for x in list(state_dict.values())]
@@ -445,216 +1432,10 @@ def update_priors(trace, state_dict):
     priors.to_csv('./data/priors.csv', index=False)
 
 def update_custom_priors(y_vec, x_matrix, state_dict, priors):
-    n_state = len(state_dict)
-    state_r = x_matrix.state.values
-
-    with pm.Model() as model:
-        
-        #hyperpriors for intercepts
-        mu_b0 = pm.Normal(
-            'mu_b0', 
-            load_priors('mu_b0', 'mean', priors),
-            sigma=load_priors('mu_b0', 'sd', priors))
-        sigma_b0 = pm.HalfCauchy('sigma_b0', load_priors('sigma_b0', 'mean', priors))
-        
-        # Random intercepts as offsets
-        mns = []
-        sds = []
-        
-        for state,num in state_dict.items():
-            if not priors.query('state == @state').empty:
-                mn = priors.query('state == @state')['mean'].iloc[0]
-                sd = priors.query('state == @state')['sd'].iloc[0]
-            else:
-                mn = 0,
-                sd = 1
-            mns.append(mn)
-            sds.append(sd)
-        
-        a_offset = pm.Normal('a_offset', mu=0, sigma=10, shape=n_state)
-        b0 = pm.Deterministic("Intercept", mu_b0 + a_offset*sigma_b0)
-
-        # Setting data
-        X1 = pm.MutableData("X1", x_matrix['Live Phone'].values)
-        X2 = pm.MutableData("X2", x_matrix['Online Panel'].values)
-        X3 = pm.MutableData("X3", x_matrix['Other'].values)
-        X4 = pm.MutableData("X4", x_matrix['month'].values)
-        X5 = pm.MutableData("X5", x_matrix['rep_poll'].values)
-        X6 = pm.MutableData("X6", x_matrix['sample_size'].values)
-        X7 = pm.MutableData("X7", x_matrix['MultiCandidate'].values)
-        X8 = pm.MutableData("X8", x_matrix['lv'].values)
-        X9 = pm.MutableData("X9", x_matrix['rv'].values)
-        X10 = pm.MutableData("X10", x_matrix['grade'].values)
-        Y_obs = pm.MutableData("Y_obs", y_vec)
-        states = pm.MutableData("states", state_r)
-
-        b1 = pm.Normal("Live Phone", mu=load_priors('Live Phone', 'mean', priors), sigma=load_priors('Live Phone', 'sd', priors))
-        b2 = pm.Normal("Online Panel", mu=load_priors('Online Panel', 'mean', priors), sigma=load_priors('Online Panel', 'sd', priors))
-        b3 = pm.Normal("Other", mu=load_priors('Other', 'mean', priors), sigma=load_priors('Other', 'sd', priors))
-        b4 = pm.Normal("month", mu=load_priors('month', 'mean', priors), sigma=load_priors('month', 'sd', priors))
-        b5 = pm.Normal("rep_poll", mu=load_priors('rep_poll', 'mean', priors), sigma=load_priors('rep_poll', 'sd', priors))
-        b6 = pm.Normal("sample_size", mu=load_priors('sample_size', 'mean', priors), sigma=load_priors('sample_size', 'sd', priors))
-        b7 = pm.Normal("MultiCandidate", mu=load_priors('MultiCandidate', 'mean', priors), sigma=load_priors('MultiCandidate', 'sd', priors))
-        b8 = pm.Normal("lv", mu=load_priors('lv', 'mean', priors), sigma=load_priors('lv', 'sd', priors))
-        b9 = pm.Normal("rv", mu=load_priors('rv', 'mean', priors), sigma=load_priors('rv', 'sd', priors))
-        b10 = pm.Normal("grade", mu=load_priors('grade', 'mean', priors), sigma=load_priors('grade', 'sd', priors))
-
-        Mu =  pm.invlogit(
-            b0[states] + 
-            b1*X1 + 
-            b2*X2 + 
-            b3*X3 + 
-            b4*X4 +
-            b5*X5 +
-            b6*X6 +
-            b7*X7 +
-            b8*X8 +
-            b9*X9 +
-            b10*X10
-        )
-
-        Phi = pm.Normal('phi', 100)
-        
-        A = pm.Deterministic('A', pm.math.switch(Mu*Phi <= 0, -np.inf, Mu*Phi))
-        B = pm.Deterministic('B', pm.math.switch(Phi-A <= 0, -np.inf, Phi-A))
-        
-        obs = pm.Beta('y', alpha = A, beta = B,observed=Y_obs)
-
-        trace = pm.sample(1000, tune=1000, cores=1, init = 'adapt_diag', target_accept = 0.9) #,  
-
-        return model, trace
+    return fit_model(y_vec, x_matrix, state_dict, 'beta', priors)
 
 def fit_bayes_beta(y_vec, x_matrix, state_dict):
-    n_state = len(state_dict)
-    state_r = x_matrix.state.values
-    
-    sgma = 0.01
-
-    with pm.Model() as model:
-        
-        sgma = 20
-        
-        # Random intercepts as offsets
-        mu_b0 = pm.Normal('mu_b0', 0, sigma=1)
-        sigma_b0 = pm.HalfCauchy('sigma_b0', 1)
-        a_offset = pm.Normal('a_offset', mu=0, sigma=10, shape=n_state)
-        b0 = pm.Deterministic("Intercept", mu_b0 + a_offset*sigma_b0)
-
-        # Setting data
-        X1 = pm.MutableData("X1", x_matrix['Live Phone'].values)
-        X2 = pm.MutableData("X2", x_matrix['Online Panel'].values)
-        X3 = pm.MutableData("X3", x_matrix['Other'].values)
-        X4 = pm.MutableData("X4", x_matrix['month'].values)
-        X5 = pm.MutableData("X5", x_matrix['rep_poll'].values)
-        X6 = pm.MutableData("X6", x_matrix['sample_size'].values)
-        X7 = pm.MutableData("X7", x_matrix['MultiCandidate'].values)
-        X8 = pm.MutableData("X8", x_matrix['lv'].values)
-        X9 = pm.MutableData("X9", x_matrix['rv'].values)
-        X10 = pm.MutableData("X10", x_matrix['grade'].values)
-        Y_obs = pm.MutableData("Y_obs", y_vec)
-        states = pm.MutableData("states", state_r)
-
-        b1 = pm.Normal("Live Phone", mu=0, sigma=sgma)
-        b2 = pm.Normal("Online Panel", mu=0, sigma=sgma)
-        b3 = pm.Normal("Other", mu=0, sigma=sgma)
-        b4 = pm.Normal("month", mu=0, sigma=0.1)
-        b5 = pm.Normal("rep_poll", mu=0, sigma=sgma)
-        b6 = pm.Normal("sample_size", mu=0, sigma=10)
-        b7 = pm.Normal("MultiCandidate", mu=0, sigma=sgma)
-        b8 = pm.Normal("lv", mu=0, sigma=sgma)
-        b9 = pm.Normal("rv", mu=0, sigma=sgma)
-        b10 = pm.Normal("grade", mu=0, sigma=sgma)
-
-        Mu =  pm.invlogit(
-            b0[states] + 
-            b1*X1 + 
-            b2*X2 + 
-            b3*X3 + 
-            b4*X4 +
-            b5*X5 +
-            b6*X6 +
-            b7*X7 +
-            b8*X8 +
-            b9*X9 +
-            b10*X10
-        )
-
-        Phi = pm.Normal('phi', 100)
-        
-        A = pm.Deterministic('A', pm.math.switch(Mu*Phi <= 0, -np.inf, Mu*Phi))
-        B = pm.Deterministic('B', pm.math.switch(Phi-A <= 0, -np.inf, Phi-A))
-        
-        obs = pm.Beta('y', alpha = A, beta = B,observed=Y_obs)
-
-        trace = pm.sample(1000, tune=1000, cores=1, init = 'adapt_diag', target_accept = 0.9) #,  
-
-        return model, trace
+    return fit_model(y_vec, x_matrix, state_dict, 'beta')
 
 def fit_bayes_beta_custom(y_vec, x_matrix, state_dict):
-    n_state = len(state_dict)
-    state_r = x_matrix.state.values
-    
-    sgma = 0.01
-
-    with pm.Model() as model:
-        
-        sgma = 1
-        
-        # Random intercepts as offsets
-        mu_b0 = pm.Normal('mu_b0', 0, sigma=1)
-        sigma_b0 = pm.HalfCauchy('sigma_b0', 1)
-        
-        # Random intercepts as offsets
-        a_offset = pm.Normal('a_offset', mu=0, sigma=10, shape=n_state)
-        b0 = pm.Deterministic("Intercept", mu_b0 + a_offset*sigma_b0)
-
-        # Setting data
-        X1 = pm.MutableData("X1", x_matrix['Live Phone'].values)
-        X2 = pm.MutableData("X2", x_matrix['Online Panel'].values)
-        X3 = pm.MutableData("X3", x_matrix['Other'].values)
-        X4 = pm.MutableData("X4", x_matrix['month'].values)
-        X5 = pm.MutableData("X5", x_matrix['rep_poll'].values)
-        X6 = pm.MutableData("X6", x_matrix['sample_size'].values)
-        X7 = pm.MutableData("X7", x_matrix['MultiCandidate'].values)
-        X8 = pm.MutableData("X8", x_matrix['lv'].values)
-        X9 = pm.MutableData("X9", x_matrix['rv'].values)
-        X10 = pm.MutableData("X10", x_matrix['grade'].values)
-        Y_obs = pm.MutableData("Y_obs", y_vec)
-        states = pm.MutableData("states", state_r)
-
-        b1 = pm.Normal("Live Phone", mu=0, sigma=sgma)
-        b2 = pm.Normal("Online Panel", mu=0, sigma=sgma)
-        b3 = pm.Normal("Other", mu=0, sigma=sgma)
-        b4 = pm.Normal("month", mu=0, sigma=0.1)
-        b5 = pm.Normal("rep_poll", mu=0, sigma=sgma)
-        b6 = pm.Normal("sample_size", mu=0, sigma=10)
-        b7 = pm.Normal("MultiCandidate", mu=0, sigma=sgma)
-        b8 = pm.Normal("lv", mu=0, sigma=sgma)
-        b9 = pm.Normal("rv", mu=0, sigma=sgma)
-        b10 = pm.Normal("grade", mu=0, sigma=sgma)
-
-        Mu =  pm.invlogit(
-            b0[states] + 
-            b1*X1 + 
-            b2*X2 + 
-            b3*X3 + 
-            b4*X4 +
-            b5*X5 +
-            b6*X6 +
-            b7*X7 +
-            b8*X8 +
-            b9*X9 +
-            b10*X10
-        )
-
-        sd = pm.HalfNormal('sd', sigma = 35)
-        Phi = ((Mu * (1 - Mu)) / (sd**2 - 1))
-        
-        A = Mu*Phi
-        B = Phi-A
-        
-        obs = pm.Beta('y', alpha = A, beta = B,observed=Y_obs)
-
-        trace = pm.sample(1000, tune=1000, cores=1, init = 'adapt_diag', target_accept = 0.9) #,  
-
-        return model, trace
+    return fit_model(y_vec, x_matrix, state_dict, 'beta_sd')
@@ -0,0 +1,139 @@
+import asyncio
+import hashlib
+import json
+import os
+import time
+import warnings
+
+import requests
+from tenacity import AsyncRetrying, retry_if_exception, stop_after_attempt, wait_exponential
+
+CACHE_DIR = './data/cache'
+
+def _cache_paths(url, cache_dir):
+    '''
+    body and metadata paths of the cached copy of url
+    '''
+    key = hashlib.sha256(url.encode()).hexdigest()[:16]
+    name = os.path.basename(url.split('?')[0]) or 'index'
+    body_path = os.path.join(cache_dir, f'{key}_{name}')
+    return body_path, body_path + '.json'
+
+def _read_meta(meta_path):
+    if not os.path.exists(meta_path):
+        return {}
+    with open(meta_path) as f:
+        return json.load(f)
+
+def _write_meta(meta_path, meta):
+    with open(meta_path, 'w') as f:
+        json.dump(meta, f)
+
+def cached_download(url, ttl=0, cache_dir=CACHE_DIR, offline=False, timeout=60, fallback=True):
+    '''
+    returns the path of a local copy of url, downloading it only when needed
+
+    a cached copy younger than ttl seconds is used without a request
+    (ttl=None never expires), older copies are revalidated with
+    If-None-Match / If-Modified-Since so an unchanged source costs one 304;
+    offline=True, or a failed request, serves the cached copy if there is one
+    (fallback=False raises the request error instead)
+
+    local paths are returned unchanged
+    '''
+    if not url.startswith(('http://', 'https://')):
+        return url
+
+    os.makedirs(cache_dir, exist_ok=True)
+    body_path, meta_path = _cache_paths(url, cache_dir)
+    meta = _read_meta(meta_path)
+    cached = os.path.exists(body_path)
+
+    if cached and offline:
+        return body_path
+    if offline:
+        raise FileNotFoundError(f"No cached copy of {url} to use offline")
+    if cached and (ttl is None or time.time() - meta.get('fetched_at', 0) < ttl):
+        return body_path
+
+    headers = {}
+    if cached and meta.get('etag'):
+        headers['If-None-Match'] = meta['etag']
+    if cached and meta.get('last_modified'):
+        headers['If-Modified-Since'] = meta['last_modified']
+
+    try:
+        with requests.get(url, headers=headers, timeout=timeout, stream=True) as response:
+            if response.status_code == 304 and cached:
+                meta['fetched_at'] = time.time()
+                _write_meta(meta_path, meta)
+                return body_path
+
+            response.raise_for_status()
+
+            # stream to a temporary file so a failed download never
+            # replaces a good cached copy
+            tmp_path = body_path + '.tmp'
+            with open(tmp_path, 'wb') as f:
+                for chunk in response.iter_content(chunk_size=1 << 20):
+                    f.write(chunk)
+            os.replace(tmp_path, body_path)
+
+            _write_meta(meta_path, {
+                'url': url,
+                'etag': response.headers.get('ETag'),
+                'last_modified': response.headers.get('Last-Modified'),
+                'fetched_at': time.time()
+            })
+    except requests.RequestException as e:
+        if not cached or not fallback:
+            raise
+        warnings.warn(f"Could not refresh {url} ({e}), using the cached copy")
+
+    return body_path
+
+def _is_transient(e):
+    '''
+    connection errors, timeouts and 5xx responses are worth retrying
+    '''
+    if isinstance(e, requests.HTTPError):
+        return e.response is not None and e.response.status_code >= 500
+    return isinstance(e, requests.RequestException)
+
+async def _fetch(url, ttl, cache_dir, offline, timeout, attempts):
+    retrying = AsyncRetrying(
+        stop=stop_after_attempt(attempts),
+        wait=wait_exponential(multiplier=1, max=30),
+        retry=retry_if_exception(_is_transient),
+        reraise=True
+    )
+    try:
+        async for attempt in retrying:
+            with attempt:
+                # requests is blocking, each download streams to disk in its own thread
+                return await asyncio.to_thread(cached_download, url, ttl, cache_dir, offline, timeout, False)
+    except requests.RequestException as e:
+        body_path, _ = _cache_paths(url, cache_dir)
+        if not os.path.exists(body_path):
+            raise
+        warnings.warn(f"Could not refresh {url} ({e}), using the cached copy")
+        return body_path
+
+async def fetch_all(sources, cache_dir=CACHE_DIR, offline=False, timeout=60, attempts=4):
+    '''
+    downloads sources, a dict of name -> (url, ttl), concurrently through
+    the cache and returns name -> local path
+
+    transient failures are retried with exponential backoff before
+    falling back to the cached copy
+    '''
+    paths = await asyncio.gather(*(
+        _fetch(url, ttl, cache_dir, offline, timeout, attempts) for url, ttl in sources.values()
+    ))
+    return dict(zip(sources, paths))
+
+def fetch_sources(sources, **kwargs):
+    '''
+    blocking wrapper around fetch_all for scripts
+    '''
+    return asyncio.run(fetch_all(sources, **kwargs))
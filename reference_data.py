@@ -0,0 +1,107 @@
+import json
+import os
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+from http_cache import cached_download, fetch_sources
+
+REFERENCE_DIR = './data/reference'
+MANIFEST = 'manifest.json'
+
+STATES_URL = 'https://raw.githubusercontent.com/jasonong/List-of-US-States/master/states.csv'
+AVERAGES_2020_URL = 'https://projects.fivethirtyeight.com/2020-general-data/presidential_poll_averages_2020.csv'
+
+def _reference_path(name, reference_dir=REFERENCE_DIR):
+    return os.path.join(reference_dir, name)
+
+def read_manifest(reference_dir=REFERENCE_DIR):
+    '''
+    version and sources of the bundled reference tables
+    '''
+    with open(_reference_path(MANIFEST, reference_dir)) as f:
+        return json.load(f)
+
+@lru_cache(maxsize=None)
+def state_abbreviations(reference_dir=REFERENCE_DIR):
+    '''
+    state name -> postal abbreviation, read once per process
+    '''
+    table = pd.read_csv(_reference_path('state_abbreviations.csv', reference_dir))
+    return dict(zip(table.State, table.Abbreviation))
+
+@lru_cache(maxsize=None)
+def fallback_states_2020(reference_dir=REFERENCE_DIR):
+    '''
+    state -> 99/1 Trump win percentage from the final 2020 polling averages,
+    read once per process
+    '''
+    table = pd.read_csv(_reference_path('fallback_states_2020.csv', reference_dir))
+    return dict(zip(table.state, table.pct_estimate.astype(float)))
+
+def fallback_states_from_source(averages_url=AVERAGES_2020_URL):
+    '''
+    rebuilds the 2020 fallback table from the 538 averages,
+    NE-3 is missing from the source and added as safe Trump
+    '''
+    # the 2020 averages are final, so the cached copy never expires
+    old_data = pd.read_csv(cached_download(averages_url, ttl=None)).query("candidate_name == 'Donald Trump' and modeldate == '11/3/2020'")[['state', 'pct_estimate']] \
+        .assign(pct_estimate = lambda x:np.where(x.pct_estimate>50,99,1))
+
+    old_data = pd.concat([old_data,pd.DataFrame({'state':"NE-3", 'pct_estimate':99}, index=[0])])
+
+    return old_data.reset_index(drop=True)
+
+def _write_manifest(reference_dir, sources):
+    '''
+    bumps the manifest version, recording the sources of the regenerated
+    tables; a regenerated fallback table is complete
+    '''
+    manifest_path = _reference_path(MANIFEST, reference_dir)
+    manifest = read_manifest(reference_dir) if os.path.exists(manifest_path) else {'version': 0, 'sources': {}}
+
+    manifest['version'] += 1
+    manifest['sources'].update(sources)
+    if 'fallback_states_2020.csv' in sources:
+        manifest['complete'] = True
+
+    with open(manifest_path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+        f.write('\n')
+
+def _write_fallback_table(reference_dir, averages_url):
+    os.makedirs(reference_dir, exist_ok=True)
+    fallback = fallback_states_from_source(averages_url)
+    fallback.to_csv(_reference_path('fallback_states_2020.csv', reference_dir), index=False)
+    fallback_states_2020.cache_clear()
+
+def refresh_fallback_states(reference_dir=REFERENCE_DIR, averages_url=AVERAGES_2020_URL):
+    '''
+    regenerates the bundled 2020 fallback table from the 538 averages
+    '''
+    _write_fallback_table(reference_dir, averages_url)
+    _write_manifest(reference_dir, {'fallback_states_2020.csv': averages_url})
+
+def refresh_reference_data(reference_dir=REFERENCE_DIR, states_url=STATES_URL, averages_url=AVERAGES_2020_URL):
+    '''
+    regenerates the bundled tables from their sources and bumps the manifest version
+    '''
+    os.makedirs(reference_dir, exist_ok=True)
+
+    paths = fetch_sources({'states': (states_url, None), 'averages_2020': (averages_url, None)})
+
+    states = pd.read_csv(paths['states'])[['State', 'Abbreviation']]
+    states.to_csv(_reference_path('state_abbreviations.csv', reference_dir), index=False)
+    state_abbreviations.cache_clear()
+
+    _write_fallback_table(reference_dir, paths['averages_2020'])
+
+    _write_manifest(reference_dir, {
+        'state_abbreviations.csv': states_url,
+        'fallback_states_2020.csv': averages_url
+    })
+
+if __name__ == '__main__':
+    refresh_reference_data()
+    print(read_manifest())
@@ -0,0 +1,25 @@
+import numpy as np
+import pytest
+
+from benchmarks import synthetic_polls
+
+@pytest.fixture
+def raw_polls():
+    '''
+    a small president_polls.csv stand-in with every column load_polling_data reads
+    '''
+    data = synthetic_polls(300, seed=1)
+    rng = np.random.default_rng(1)
+    question = data.groupby('question_id').ngroup().values
+    n_questions = question.max() + 1
+
+    def per_question(values, p=None):
+        return rng.choice(values, size=n_questions, p=p)[question]
+
+    return data.assign(
+        methodology = per_question(['Online Panel', 'Live Phone', 'Probability Panel', 'IVR']),
+        population = per_question(['lv', 'rv', 'a', 'v']),
+        partisan = per_question(['REP', 'DEM', np.nan]),
+        end_date = per_question(['1/15/24', '6/1/24', '9/30/24', '10/28/24']),
+        numeric_grade = per_question([1.5, 2.0, 3.0, np.nan])
+    )
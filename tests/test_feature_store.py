@@ -0,0 +1,32 @@
+import numpy as np
+import pandas as pd
+
+from election_helpers import build_design_matrix, clean_polls, update_feature_store
+
+def test_incremental_update_matches_a_full_rebuild(raw_polls, tmp_path):
+    store = str(tmp_path / 'cleaned_polls.csv')
+    state_index = tmp_path / 'state_index.csv'
+
+    # an earlier run saw the first half of the questions
+    earlier = raw_polls.question_id.isin(np.sort(raw_polls.question_id.unique())[::2])
+    update_feature_store(raw_polls.loc[earlier], store)
+
+    incremental = update_feature_store(raw_polls, store)
+    full = clean_polls(raw_polls)
+
+    pd.testing.assert_frame_equal(incremental, full)
+
+    y_incremental, X_incremental, _ = build_design_matrix(incremental, state_index)
+    y_full, X_full, _ = build_design_matrix(full, state_index)
+
+    assert np.array_equal(y_incremental, y_full)
+    pd.testing.assert_frame_equal(X_incremental, X_full)
+
+def test_seen_questions_are_not_recleaned(raw_polls, tmp_path):
+    store = str(tmp_path / 'cleaned_polls.csv')
+    first = update_feature_store(raw_polls, store)
+
+    # questions already processed are taken from the store as they are
+    revised = raw_polls.assign(pct = raw_polls.pct + 1)
+    pd.testing.assert_frame_equal(update_feature_store(revised, store), first)
+    assert not update_feature_store(revised, store, rebuild=True).pct.equals(first.pct)
@@ -0,0 +1,110 @@
+import http.server
+import threading
+
+import pytest
+
+from http_cache import fetch_sources
+
+BODY = b'question_id,pct\n1,45.0\n'
+ETAG = '"v1"'
+
+class StandIn(http.server.BaseHTTPRequestHandler):
+    '''
+    local stand-in for a remote source: serves BODY with an ETag, answers
+    a matching If-None-Match with 304 and fails the first `failures`
+    requests with `status`
+    '''
+    failures = 0
+    status = 503
+    log = []
+
+    def do_GET(self):
+        cls = type(self)
+        if cls.failures > 0:
+            cls.failures -= 1
+            cls.log.append(cls.status)
+            self.send_response(cls.status)
+            self.end_headers()
+            return
+
+        if self.headers.get('If-None-Match') == ETAG:
+            cls.log.append(304)
+            self.send_response(304)
+            self.end_headers()
+            return
+
+        cls.log.append(200)
+        self.send_response(200)
+        self.send_header('ETag', ETAG)
+        self.send_header('Content-Length', str(len(BODY)))
+        self.end_headers()
+        self.wfile.write(BODY)
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def source():
+    StandIn.failures = 0
+    StandIn.status = 503
+    StandIn.log = []
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), StandIn)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{server.server_port}/president_polls.csv'
+    server.shutdown()
+    server.server_close()
+
+def read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+def test_retries_transient_errors(source, tmp_path):
+    StandIn.failures = 1
+
+    paths = fetch_sources({'polls': (source, 0)}, cache_dir=tmp_path)
+
+    assert StandIn.log == [503, 200]
+    assert read(paths['polls']) == BODY
+
+def test_does_not_retry_client_errors(source, tmp_path):
+    StandIn.failures = 1
+    StandIn.status = 404
+
+    with pytest.raises(Exception):
+        fetch_sources({'polls': (source, 0)}, cache_dir=tmp_path)
+
+    assert StandIn.log == [404]
+
+def test_revalidates_with_etag(source, tmp_path):
+    first = fetch_sources({'polls': (source, 0)}, cache_dir=tmp_path)
+    second = fetch_sources({'polls': (source, 0)}, cache_dir=tmp_path)
+
+    assert StandIn.log == [200, 304]
+    assert first == second
+    assert read(second['polls']) == BODY
+
+def test_ttl_skips_the_request(source, tmp_path):
+    fetch_sources({'polls': (source, None)}, cache_dir=tmp_path)
+    fetch_sources({'polls': (source, None)}, cache_dir=tmp_path)
+
+    assert StandIn.log == [200]
+
+def test_falls_back_to_cached_copy(source, tmp_path):
+    fetch_sources({'polls': (source, 0)}, cache_dir=tmp_path)
+    StandIn.failures = 1
+
+    with pytest.warns(UserWarning, match='using the cached copy'):
+        paths = fetch_sources({'polls': (source, 0)}, cache_dir=tmp_path, attempts=1)
+
+    assert StandIn.log == [200, 503]
+    assert read(paths['polls']) == BODY
+
+def test_fetches_every_source(source, tmp_path):
+    paths = fetch_sources(
+        {'polls': (source, 0), 'polls_copy': (source + '?copy=1', 0)}, cache_dir=tmp_path
+    )
+
+    assert set(paths) == {'polls', 'polls_copy'}
+    assert paths['polls'] != paths['polls_copy']
+    assert all(read(path) == BODY for path in paths.values())
@@ -0,0 +1,56 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import election_helpers as eh
+
+SAMPLE = dict(draws=20, tune=20, chains=1, progressbar=False,
+              compute_convergence_checks=False, random_seed=1)
+
+@pytest.fixture
+def design(raw_polls, tmp_path):
+    return eh.build_design_matrix(eh.clean_polls(raw_polls), tmp_path / 'state_index.csv')
+
+def stored_priors(state_dict):
+    '''
+    a priors.csv frame, as written by update_priors, far from the flat priors
+    '''
+    return pd.DataFrame({
+        'var': ['mu_b0', 'sigma_b0', 'error', *eh.COVARIATES,
+                *[f'a_offset[{i}]' for i in state_dict.values()]],
+        'mean': [3.0, 0.5, 0.2, *[1.0]*len(eh.COVARIATES), *[2.0]*len(state_dict)],
+        'sd': [0.1, 0.1, 0.1, *[0.1]*len(eh.COVARIATES), *[0.1]*len(state_dict)],
+        'state': [np.nan]*(3 + len(eh.COVARIATES)) + list(state_dict)
+    })
+
+def predicted(model, state_dict, x_matrix, trace):
+    return eh.sample_state_predictions(model, state_dict, x_matrix, trace) \
+        .predictions['y'].values
+
+def test_predicts_from_an_earlier_fit(design):
+    y_vec, x_matrix, state_dict = design
+
+    model, trace = eh.fit_model(y_vec, x_matrix, state_dict, 'normal', **SAMPLE)
+    first = predicted(model, state_dict, x_matrix, trace)
+
+    # a later fit of the same structure swaps the priors of the shared model
+    later_model, _ = eh.fit_model(y_vec, x_matrix, state_dict, 'normal',
+                                  stored_priors(state_dict), stored_offsets=True, **SAMPLE)
+    assert later_model is model
+
+    np.testing.assert_array_equal(predicted(model, state_dict, x_matrix, trace), first)
+
+def test_cached_model_matches_a_fresh_one(design):
+    y_vec, x_matrix, state_dict = design
+    priors = stored_priors(state_dict)
+
+    eh.fit_model(y_vec, x_matrix, state_dict, 'normal', **SAMPLE)
+    cached, _ = eh.fit_model(y_vec, x_matrix, state_dict, 'normal',
+                             priors, stored_offsets=True, **SAMPLE)
+    fresh = eh.build_model(
+        y_vec, x_matrix, eh.n_states(state_dict), 'normal',
+        eh.model_priors('normal', state_dict, priors, stored_offsets=True)
+    )
+
+    point = fresh.initial_point()
+    assert cached.point_logps(point) == fresh.point_logps(point)
@@ -0,0 +1,15 @@
+import numpy as np
+import pandas as pd
+
+from benchmarks import synthetic_polls, _legacy_head_to_head
+from election_helpers import _clean_head_to_head
+
+def test_matches_the_groupby_apply_cleaning():
+    data = synthetic_polls(500, seed=2)
+
+    legacy = _legacy_head_to_head(data.copy()).reset_index(drop=True)
+    vectorized = _clean_head_to_head(data.copy()).reset_index(drop=True)[legacy.columns]
+
+    # summing the two answers in another order can move pct by an ulp
+    pd.testing.assert_frame_equal(legacy.drop(columns=['pct']), vectorized.drop(columns=['pct']))
+    np.testing.assert_allclose(vectorized.pct, legacy.pct, rtol=1e-15)